@@ -0,0 +1,121 @@
+# background.py
+
+import threading
+import numpy as np
+from simulation import iter_simulation
+from results_recorder_class import ResultsRecorder, RESULT_VARIABLES, allocate_results
+from profiling import PhaseTimer, SamplingProfiler
+from kpis import FleetKPIs
+
+# Simulations running in background threads, so a caller (the dashboard) never blocks on a run.
+# A SimulationJob steps the run in chunks (iter_simulation) and copies every chunk into one results buffer,
+# publishing how far it got; results() returns what has been simulated so far at any time. cancel() stops
+# the job at the next chunk boundary. JobRegistry keeps jobs by config_hash, so reruns and other sessions
+# asking for the same configuration find the job already running instead of starting it again.
+
+PROGRESS_CHUNK = 48  # iterations stepped between progress updates
+
+class SimulationJob:
+    def __init__(self, key, iterations, mps_configs, hub_config, chunk_size=PROGRESS_CHUNK, sample=False, variables=RESULT_VARIABLES, dtype=np.float64, step_hours=None):
+        self.key = key
+        self.iterations = iterations
+        self.mps_configs = mps_configs
+        self.hub_config = hub_config
+        self.chunk_size = chunk_size
+        self.sample = sample  # attach a sampling profile of the job thread to the timer
+        self.variables = variables
+        self.dtype = dtype
+        self.step_hours = step_hours
+
+        self.timer = PhaseTimer()
+        self.kpis = FleetKPIs()  # fleet KPIs of the iterations simulated so far
+        self.done = 0  # iterations simulated so far
+        self.error = None
+        self.names = None
+        self.buffer = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"simulation-{key[:8]}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        profiler = SamplingProfiler().start() if self.sample else None
+        try:
+            chunks = iter_simulation(self.iterations, self.mps_configs, self.hub_config, self.chunk_size, self.variables, self.dtype, self.step_hours, self.timer, self.kpis)
+            for start, results in chunks:
+                if self.buffer is None:
+                    self.names = list(results)
+                    self.buffer, _ = allocate_results(self.names, self.iterations, self.variables, self.dtype)
+                length = results[self.names[0]].length
+                for i, name in enumerate(self.names):
+                    self.buffer[:, i, start:start + length] = results[name].data[:, :length]
+                with self._lock:
+                    self.done = start + length
+                if self._cancel.is_set():
+                    break
+        except Exception as error:
+            self.error = error
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                self.timer.profile = profiler.report()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    @property
+    def finished(self):
+        # ran to the end without error
+        return not self.running and self.error is None and self.done == self.iterations
+
+    @property
+    def progress(self):
+        return self.done / self.iterations if self.iterations else 1.0
+
+    def results(self):
+        # recorders (keyed like run_simulation) over the iterations simulated so far, None before the first chunk
+        with self._lock:
+            done = self.done
+        if self.buffer is None:
+            return None
+        results = {}
+        for i, name in enumerate(self.names):
+            recorder = ResultsRecorder(name, variables=self.variables, buffer=self.buffer[:, i, :])
+            recorder.length = done
+            results[name] = recorder
+        return results
+
+class JobRegistry:
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start(self, key, *args, **kwargs):
+        # the job of this configuration, started unless it is already there
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None or job.cancelled or job.error is not None:
+                job = self.jobs[key] = SimulationJob(key, *args, **kwargs).start()
+            return job
+
+    def get(self, key):
+        with self.lock:
+            return self.jobs.get(key)
+
+    def discard(self, key):
+        with self.lock:
+            return self.jobs.pop(key, None)
@@ -0,0 +1,323 @@
+# bench_simulation.py
+#
+# Benchmarks for the simulation core and the dashboard plotting path.
+#
+#   python benchmarks/bench_simulation.py                 # run and print
+#   python benchmarks/bench_simulation.py --save          # run and write the baseline file
+#   python benchmarks/bench_simulation.py --compare       # run and flag regressions against the baseline
+#   python benchmarks/bench_simulation.py --check         # golden trajectory, step size, network and incremental checks only
+#   python benchmarks/make_golden.py                      # regenerate the golden trajectories (from the baseline)
+#
+# Each case sweeps fleet size and horizon and records wall time (best of --repeat), peak traced memory
+# and cost per unit-step. Case/size combinations above a case's cell budget (units * steps) are skipped.
+
+import argparse
+import functools
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import profile_cache
+from fleet_class import Fleet
+from mps_class import MPS, TYPE_STD
+from simulation import run_simulation
+from solar_input_class import SolarInput
+
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+GOLDEN_FILE = os.path.join(ROOT, 'benchmarks', 'golden.npz')  # written by make_golden.py
+FLEET_SIZES = [1, 10, 100, 1000, 10000]
+HORIZONS = [48, 48 * 7, 48 * 365]  # a day, a week and a year of half hour steps
+QUICK_FLEET_SIZES = [1, 100]
+QUICK_HORIZONS = [48, 48 * 7]
+REGRESSION_TOLERANCE = 1.25  # flag cases more than 25% slower (or larger) than the baseline
+NOISE_FLOOR = {'wall_s': 0.005, 'peak_bytes': 2**20}  # differences below these are timer / allocator noise
+GOLDEN_ITERATIONS = 500
+GOLDEN_SEEDS = range(20)
+STEP_SIZE_TOLERANCE = 1e-3  # daily energy at different step sizes (the profiles are sampled, not integrated)
+
+# engines (run_simulation options) checked against the golden trajectories of the baseline MPS.update
+ENGINES = {
+    'mps': {'engine': 'mps'},
+    'fleet': {'engine': 'fleet'},
+    'fleet+fast_forward': {'engine': 'fleet', 'fast_forward': True},
+    'event': {'engine': 'event'},
+}
+
+def make_configs(units, seed=0):
+    rnd = random.Random(seed)
+    mps_configs = [{
+        'name': f"mps{i+1}",
+        'max_power': rnd.choice([2.0, 5.0, 7.5]),
+        'max_battery': rnd.choice([10.0, 40.0, 80.0]),
+        'max_solar': rnd.choice([1.0, 4.0, 8.0]),
+        'peak_sun_hours': rnd.randint(1, 12),
+        'init_soc': float(rnd.randint(0, 100)),
+        'load_power': rnd.choice([0.0, 2.0, 8.0]),
+        'load_hours': rnd.randint(0, 24),
+    } for i in range(units)]
+    hub_config = {'name': 'hub', 'max_power': 50.0, 'max_battery': 200.0, 'max_solar': 3.0, 'peak_sun_hours': 4,
+                  'init_soc': 50.0, 'load_power': 2.0, 'load_hours': 6}
+    return mps_configs, hub_config
+
+def bench_solar_input(units, iterations):
+    # SolarInput construction with a cold profile cache, one distinct panel per unit
+    profile_cache.solar_curve.cache_clear()
+    for i in range(units):
+        SolarInput(1.0 + i * 1e-3, 4)
+
+def bench_mps_update(units, iterations):
+    mps_configs, _ = make_configs(units)
+    systems = [MPS(mps_type=TYPE_STD, iterations=iterations, **config) for config in mps_configs]
+    for iteration in range(iterations):
+        for mps in systems:
+            mps.update(iteration)
+
+def bench_run_simulation(engine):
+    def bench(units, iterations):
+        mps_configs, hub_config = make_configs(units)
+        run_simulation(iterations, mps_configs, hub_config, engine=engine)
+    return bench
+
+def bench_lp_dispatch(units, iterations):
+    # fleet engine with the rolling-horizon LP dispatcher instead of the greedy rules
+    from dispatch import LPDispatcher
+    mps_configs, hub_config = make_configs(units)
+    run_simulation(iterations, mps_configs, hub_config, step_hours=0.5, record=False, dispatcher=LPDispatcher())
+
+def bench_fleet_step(units, iterations):
+    # stepping only, no results recorded
+    mps_configs, hub_config = make_configs(units)
+    Fleet(mps_configs, hub_config).run(iterations, record=False)
+
+@functools.lru_cache(maxsize=None)
+def load_dashboard():
+    # the dashboard module (Streamlit, Plotly, ...), only needed by the plot case; importing it outside a
+    # Streamlit run warns about the missing script context, which is expected here
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return _import_dashboard()
+
+def _import_dashboard():
+    spec = importlib.util.spec_from_file_location('dashboard', os.path.join(ROOT, 'smart-bi-directional-simulation.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def bench_plot(units, iterations):
+    # build and serialize (what is sent to the browser) the per-system figure of every system
+    from results_table import ResultsTable
+    dashboard = load_dashboard()
+    mps_configs, hub_config = make_configs(units)
+    table = ResultsTable(run_simulation(iterations, mps_configs, hub_config, engine='fleet'))
+    for system in table.systems:
+        dashboard.build_results_figure(system, table, iterations).to_json()
+
+# name -> (function, max units * steps)
+CASES = {
+    'solar_input': (bench_solar_input, 10**9),
+    'mps_update': (bench_mps_update, 2 * 10**6),
+    'run_simulation[mps]': (bench_run_simulation('mps'), 2 * 10**6),
+    'run_simulation[fleet]': (bench_run_simulation('fleet'), 5 * 10**6),
+    'run_simulation[event]': (bench_run_simulation('event'), 5 * 10**6),
+    'fleet_step': (bench_fleet_step, 2 * 10**8),
+    'lp_dispatch': (bench_lp_dispatch, 4 * 10**4),
+    'plot': (bench_plot, 2 * 10**5),
+}
+
+def measure(function, units, iterations, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(units, iterations)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function(units, iterations)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    wall = min(times)
+    return {'wall_s': wall, 'peak_bytes': peak, 'per_unit_step_us': 1e6 * wall / (units * iterations)}
+
+def run_benchmarks(cases, fleet_sizes, horizons, repeat):
+    results = {}
+    for name in cases:
+        function, budget = CASES[name]
+        for units in fleet_sizes:
+            for iterations in horizons:
+                if units * iterations > budget:
+                    continue
+                key = f"{name}/units={units}/steps={iterations}"
+                results[key] = measure(function, units, iterations, repeat)
+                print(f"{key:50s} {results[key]['wall_s']*1e3:10.2f} ms {results[key]['peak_bytes']/2**20:9.1f} MiB "
+                      f"{results[key]['per_unit_step_us']:9.3f} us/unit-step", flush=True)
+    return results
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in ('wall_s', 'peak_bytes'):
+            if result[metric] > tolerance * baseline[key][metric] and result[metric] - baseline[key][metric] > NOISE_FLOOR[metric]:
+                regressions.append(f"{key} {metric}: {baseline[key][metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+def golden_case(seed):
+    # (mps_configs, hub_config) of one golden check case
+    return make_configs(1 + seed % 8, seed)
+
+def golden_check(seeds=GOLDEN_SEEDS):
+    # every engine must reproduce the baseline trajectories (golden.npz, step_hours=None: the baseline has no
+    # other step size) exactly; at step_hours=0.5, which the baseline cannot run, the engines must agree with
+    # engine="mps"
+    failures = []
+    with np.load(GOLDEN_FILE) as golden:
+        iterations = int(golden['iterations'])
+        variables = list(golden['variables'])
+        for seed in seeds:
+            mps_configs, hub_config = golden_case(seed)
+            names = [hub_config['name']] + [config['name'] for config in mps_configs]
+            expected = golden[f"seed{seed}"]
+            for engine, options in ENGINES.items():
+                results = run_simulation(iterations, mps_configs, hub_config, **options)
+                for i, name in enumerate(['hub'] + names[1:]):
+                    for row, var in enumerate(variables):
+                        if not np.array_equal(expected[i, row], results[name][var]):
+                            failures.append(f"engine={engine} seed={seed} step_hours=None {name}.{var} (baseline)")
+            reference = run_simulation(iterations, mps_configs, hub_config, engine='mps', step_hours=0.5)
+            for engine, options in ENGINES.items():
+                if options['engine'] == 'mps':
+                    continue
+                results = run_simulation(iterations, mps_configs, hub_config, step_hours=0.5, **options)
+                for name, data in reference.items():
+                    for var in data:
+                        if not np.array_equal(data[var], results[name][var]):
+                            failures.append(f"engine={engine} seed={seed} step_hours=0.5 {name}.{var}")
+    return failures
+
+def step_size_check(days=2, seeds=range(5), step_sizes=(1.0, 0.5, 0.25, 0.125)):
+    # the energy of a day of input must not depend on the step size it is simulated at
+    from kpis import FleetKPIs
+    failures = []
+    for seed in seeds:
+        mps_configs, hub_config = make_configs(1 + seed % 8, seed)
+        energy = {}
+        for step_hours in step_sizes:
+            kpis = FleetKPIs()
+            run_simulation(int(round(days * 24 / step_hours)), mps_configs, hub_config, step_hours=step_hours, kpis=kpis, record=False)
+            energy[step_hours] = np.array([kpis.solar_energy, kpis.load_energy])
+        for step_hours in step_sizes[1:]:
+            if not np.allclose(energy[step_hours], energy[step_sizes[0]], rtol=STEP_SIZE_TOLERANCE):
+                failures.append(f"seed={seed} step_hours={step_hours}")
+    return failures
+
+def network_check(iterations=GOLDEN_ITERATIONS, seeds=range(5), step_sizes=(None, 0.5, 0.25)):
+    # behind capacity-limited links every MPS battery changes by exactly the energy its links served, and an MPS
+    # without links is not accepted
+    from topology import run_network
+    failures = []
+    for seed in seeds:
+        mps_configs, hub_config = make_configs(4 + seed % 4, seed)
+        hubs = [dict(hub_config, name='hub1'), dict(hub_config, name='hub2')]
+        links = [{'mps': config['name'], 'hub': hubs[i % 2]['name'], 'capacity': 1.0 + i % 3} for i, config in enumerate(mps_configs)]
+        links.append({'mps': mps_configs[0]['name'], 'hub': 'hub2'})
+        for step_hours in step_sizes:
+            results, network = run_network(iterations, {'mps': mps_configs, 'hubs': hubs, 'links': links}, step_hours=step_hours)
+            flows = network.get_link_results()
+            served_in = network.unit_links @ flows['import_flow']
+            served_out = network.unit_links @ flows['export_flow']
+            for i, config in enumerate(mps_configs):
+                data = results[config['name']]
+                before = np.concatenate([[config['max_battery'] * config['init_soc'] / 100], data['remaining_battery'][:-1]])
+                transfer = np.where(data['power_in_allowed'] > 0, served_in[i], 0.0) - np.where(data['power_out_allowed'] > 0, served_out[i], 0.0)
+                expected = np.minimum(before + (data['solar_input'] - data['local_load'] + transfer) * network.step_duration, config['max_battery'])
+                if not np.allclose(data['remaining_battery'], expected):
+                    failures.append(f"seed={seed} step_hours={step_hours} {config['name']}")
+        # an MPS without links would exchange power with no hub at all: the topology is rejected
+        try:
+            run_network(iterations, {'mps': mps_configs, 'hubs': hubs, 'links': links[1:-1]})
+            failures.append(f"seed={seed} unlinked {mps_configs[0]['name']} accepted")
+        except ValueError:
+            pass
+    return failures
+
+def incremental_check(iterations=GOLDEN_ITERATIONS, seeds=range(5)):
+    # IncrementalRunner over a sequence of edits, switching units back to earlier (cached) configs, must match
+    # run_simulation: the units exactly, the hub to rounding (its aggregate is updated, not summed afresh)
+    from incremental import IncrementalRunner
+    failures = []
+    for seed in seeds:
+        mps_configs, hub_config = make_configs(3 + seed % 4, seed)
+        edited = [dict(config, load_power=config['load_power'] + 4.0, max_power=config['max_power'] + 2.5) for config in mps_configs]
+        runner = IncrementalRunner()
+        # [A, X], [B, X], [A, Y], [B, Y], [A, X]: every later run swaps units to configs that are already cached
+        for edit, (first, second) in enumerate([(0, 0), (1, 0), (0, 1), (1, 1), (0, 0)]):
+            configs = [(edited if first else mps_configs)[0], (edited if second else mps_configs)[1]] + mps_configs[2:]
+            results = runner.run(iterations, configs, hub_config)
+            reference = run_simulation(iterations, configs, hub_config)
+            for name, data in reference.items():
+                for var in data:
+                    same = np.allclose if name == 'hub' else np.array_equal
+                    if not same(data[var], results[name][var]):
+                        failures.append(f"seed={seed} edit={edit} {name}.{var}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="MPS simulator benchmarks")
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--quick', action='store_true', help="small fleet sizes and horizons only")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--compare', action='store_true', help="flag regressions against the baseline")
+    parser.add_argument('--check', action='store_true', help="only run the golden trajectory check")
+    args = parser.parse_args()
+
+    failures = golden_check()
+    for failure in failures:
+        print(f"GOLDEN MISMATCH {failure}")
+    print(f"golden check: {'FAILED' if failures else 'ok'} ({', '.join(ENGINES)} vs baseline)")
+    step_failures = step_size_check()
+    for failure in step_failures:
+        print(f"DAILY ENERGY MISMATCH {failure}")
+    print(f"step size check: {'FAILED' if step_failures else 'ok'}")
+    network_failures = network_check()
+    for failure in network_failures:
+        print(f"SERVED ENERGY MISMATCH {failure}")
+    print(f"network check: {'FAILED' if network_failures else 'ok'} (battery change = served link energy)")
+    incremental_failures = incremental_check()
+    for failure in incremental_failures:
+        print(f"INCREMENTAL MISMATCH {failure}")
+    print(f"incremental check: {'FAILED' if incremental_failures else 'ok'} (edits vs full runs)")
+    failures += step_failures + network_failures + incremental_failures
+    if args.check or failures:
+        return 1 if failures else 0
+
+    fleet_sizes = QUICK_FLEET_SIZES if args.quick else FLEET_SIZES
+    horizons = QUICK_HORIZONS if args.quick else HORIZONS
+    if 'plot' in args.cases:
+        load_dashboard()  # import streamlit/plotly outside of the timed cases
+    results = run_benchmarks(args.cases, fleet_sizes, horizons, args.repeat)
+
+    status = 0
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'])
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        status = 1 if regressions else 0
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'numpy': np.__version__, 'results': results}, f, indent=2, sort_keys=True)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
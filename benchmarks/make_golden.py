@@ -0,0 +1,82 @@
+# make_golden.py
+#
+# Writes the golden trajectories of bench_simulation.golden_check: the check cases simulated by the baseline
+# code (MPS.update and the run_simulation loop of the repository's first commit, read from git), so every engine,
+# engine="mps" included, is compared with the original semantics instead of with code that changes with it.
+#
+#   python benchmarks/make_golden.py                  # baseline = the first commit
+#   python benchmarks/make_golden.py --rev <commit>
+#
+# The baseline modules run in a child interpreter from a scratch directory, so they cannot clash with the
+# current modules of the same names.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from bench_simulation import GOLDEN_FILE, GOLDEN_ITERATIONS, GOLDEN_SEEDS, ROOT, golden_case
+from results_recorder_class import RESULT_VARIABLES
+
+BASELINE_FILES = ['mps_class.py', 'solar_input_class.py', 'load_output_class.py']
+
+# the baseline run_simulation (it lived in the dashboard), minus Streamlit
+BASELINE_RUNNER = """
+import json, sys, warnings
+import numpy as np
+warnings.simplefilter('ignore')
+from mps_class import MPS, TYPE_STD, TYPE_HUB
+
+KEYS = ['max_power', 'max_battery', 'max_solar', 'peak_sun_hours', 'init_soc', 'load_power', 'load_hours']
+request = json.load(sys.stdin)
+out = {}
+for label, (mps_configs, hub_config) in request['cases'].items():
+    mps_systems = [MPS(mps_type=TYPE_STD, name=config['name'], **{key: config[key] for key in KEYS}) for config in mps_configs]
+    hub = MPS(mps_type=TYPE_HUB, name=hub_config['name'], **{key: hub_config[key] for key in KEYS})
+    for iteration in range(request['iterations']):
+        for mps in mps_systems:
+            mps.update(iteration)
+        hub.update(iteration)
+        hub.power_in = sum(mps.power_out for mps in mps_systems)
+        hub.power_out = sum(mps.power_in for mps in mps_systems)
+    systems = [hub] + mps_systems
+    out[label] = np.array([[np.asarray(mps.results[var], dtype=np.float64) for var in request['variables']] for mps in systems])
+np.savez_compressed(request['path'], **out)
+"""
+
+def baseline_revision():
+    return subprocess.run(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=ROOT, check=True, capture_output=True, text=True).stdout.split()[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the golden trajectories from the baseline code")
+    parser.add_argument('--rev', help="baseline commit (default: the first commit)")
+    parser.add_argument('--out', default=GOLDEN_FILE)
+    args = parser.parse_args()
+    rev = args.rev or baseline_revision()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        for name in BASELINE_FILES:
+            source = subprocess.run(['git', 'show', f"{rev}:{name}"], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+            with open(os.path.join(scratch, name), 'w') as f:
+                f.write(source)
+        path = os.path.join(scratch, 'golden.npz')
+        request = {
+            'cases': {f"seed{seed}": golden_case(seed) for seed in GOLDEN_SEEDS},
+            'iterations': GOLDEN_ITERATIONS,
+            'variables': RESULT_VARIABLES,
+            'path': path,
+        }
+        subprocess.run([sys.executable, '-c', BASELINE_RUNNER], cwd=scratch, input=json.dumps(request), check=True, text=True,
+                       env=dict(os.environ, PYTHONPATH=scratch))
+        with np.load(path) as baseline:
+            arrays = dict(baseline)
+    np.savez_compressed(args.out, revision=rev, iterations=GOLDEN_ITERATIONS, variables=np.array(RESULT_VARIABLES), **arrays)
+    print(f"golden trajectories of {len(arrays)} cases from {rev[:12]} -> {os.path.relpath(args.out, ROOT)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# cli.py
+#
+# Headless batch runner: runs scenario files through run_simulation (or run_network) and writes the
+# results and a summary of every scenario to disk.
+#
+#   python cli.py examples/scenario.toml examples/network.toml --out results
+#   python cli.py scenario.json --iterations 17520 --step-hours 0.5 --format parquet --profile
+#   python cli.py examples/scenario.toml --ensemble 1000 --seed 7     # weather ensemble bands (ensemble.py)
+#
+# A scenario file (JSON or TOML) holds `mps` (list of MPS configs) and either `hub` (one hub config) or
+# `hubs` + `links` (a topology, see topology.py), plus optional run options: iterations, engine,
+# step_hours, fast_forward, variables, dispatch ("greedy" or "lp", see dispatch.py). Topologies run on the
+# fleet engine with the greedy dispatch only, and the lp dispatch and fast_forward need the fleet engine;
+# other combinations are usage errors.
+# Only NumPy is imported up front; pandas/pyarrow are imported when a format needs them and Streamlit,
+# Plotly and matplotlib never are.
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from mps_class import CUTOFF_THRESHOLD, step_duration
+from simulation import run_simulation, config_hash
+from results_recorder_class import RESULT_VARIABLES
+from profiling import PhaseTimer
+from kpis import FleetKPIs
+
+OUTPUT_FORMATS = ['npz', 'parquet', 'csv.zip']
+ENGINES = ['fleet', 'event', 'mps']
+DISPATCHES = ['greedy', 'lp']
+DEFAULT_ITERATIONS = 48
+
+def read_config(path):
+    # JSON or TOML file (by extension) as a dict
+    from topology import read_config
+    return read_config(path)
+
+def check_scenario(scenario):
+    # raises ValueError for run options the scenario's path cannot honour
+    engine = scenario.get('engine', 'fleet')
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine: {engine!r}")
+    if scenario.get('dispatch', 'greedy') not in DISPATCHES:
+        raise ValueError(f"unknown dispatch: {scenario['dispatch']!r}")
+    if 'hubs' in scenario:
+        unsupported = [f"{key}={scenario[key]!r}" for key, default in (('engine', 'fleet'), ('dispatch', 'greedy')) if scenario.get(key, default) != default]
+        if unsupported:
+            raise ValueError(f"network scenarios (hubs + links) run on the fleet engine with the greedy dispatch, not {', '.join(unsupported)}")
+    elif engine != 'fleet':
+        unsupported = [f"{key}={scenario[key]!r}" for key, default in (('dispatch', 'greedy'), ('fast_forward', False)) if scenario.get(key, default) != default]
+        if unsupported:
+            raise ValueError(f"engine={engine!r} cannot run {', '.join(unsupported)} (fleet engine only)")
+
+def run_scenario(scenario, timer=None, record=True):
+    # returns (results, link report or None, kpis.FleetKPIs or None) of one scenario dict; the fleet engine
+    # accumulates the KPIs while it steps, and with record=False keeps no results (a network still records them
+    # for its link report)
+    kpis = FleetKPIs() if scenario.get('engine', 'fleet') == 'fleet' else None
+    options = {
+        'variables': scenario.get('variables', RESULT_VARIABLES),
+        'step_hours': scenario.get('step_hours'),
+        'timer': timer,
+        'fast_forward': scenario.get('fast_forward', False),
+    }
+    iterations = scenario.get('iterations', DEFAULT_ITERATIONS)
+    check_scenario(scenario)
+    if 'hubs' in scenario:
+        from topology import run_network
+        results, network = run_network(iterations, scenario, kpis=kpis, **options)
+        return results, network.unserved_report(), kpis
+    dispatcher = None
+    if scenario.get('dispatch', 'greedy') == 'lp':
+        from dispatch import LPDispatcher
+        dispatcher = LPDispatcher()
+    results = run_simulation(iterations, scenario['mps'], scenario['hub'], engine=scenario.get('engine', 'fleet'),
+                             kpis=kpis, record=record or kpis is None, dispatcher=dispatcher, **options)
+    return results, None, kpis
+
+def summarize(results, step_hours=None):
+    # per-system SOC and energy figures of the recorded variables (engines without online KPIs)
+    hours = step_duration(step_hours)
+    summary = {}
+    for name, data in results.items():
+        row = {}
+        if 'soc' in data:
+            soc = data['soc']
+            row.update(min_soc=float(soc.min()), mean_soc=float(soc.mean()), final_soc=float(soc[-1]),
+                       steps_below_cutoff=int((soc < CUTOFF_THRESHOLD).sum()))
+        if 'power_in' in data:
+            row['energy_in'] = float(data['power_in'].sum() * hours)
+        if 'power_out' in data:
+            row['energy_out'] = float(data['power_out'].sum() * hours)
+        summary[name] = row
+    return summary
+
+def write_results(results, path, fmt):
+    if fmt == 'npz':
+        # (system, variable, iteration) array plus the system and variable names
+        names = list(results)
+        first = results[names[0]]
+        np.savez(path, systems=np.array(names), variables=np.array(first.variables),
+                 values=np.stack([results[name].data[:, :results[name].length] for name in names]))
+    else:
+        from results_table import ResultsTable
+        with open(path, 'wb') as f:
+            f.write(ResultsTable(results).export(fmt))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run MPS scenario files without the dashboard")
+    parser.add_argument('scenarios', nargs='+', help="scenario files (.json or .toml)")
+    parser.add_argument('--out', default='results', help="output directory")
+    parser.add_argument('--format', default='npz', choices=OUTPUT_FORMATS)
+    parser.add_argument('--iterations', type=int, help="override the scenario iterations")
+    parser.add_argument('--engine', choices=ENGINES, help="override the scenario engine")
+    parser.add_argument('--step-hours', type=float, help="override the scenario step size")
+    parser.add_argument('--dispatch', choices=DISPATCHES, help="override the scenario hub dispatch")
+    parser.add_argument('--fast-forward', action='store_true', help="replay the daily cycle once it repeats")
+    parser.add_argument('--no-results', action='store_true', help="write the summaries only")
+    parser.add_argument('--profile', action='store_true', help="add phase timings to the summaries")
+    parser.add_argument('--ensemble', type=int, metavar='MEMBERS', help="also run a stochastic weather ensemble of that many members")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the weather ensemble")
+    args = parser.parse_args(argv)
+
+    overrides = {'iterations': args.iterations, 'engine': args.engine, 'step_hours': args.step_hours,
+                 'dispatch': args.dispatch, 'fast_forward': args.fast_forward or None}
+    scenarios = []
+    for path in args.scenarios:
+        scenario = read_config(path)
+        scenario.update({key: value for key, value in overrides.items() if value is not None})
+        try:
+            check_scenario(scenario)
+        except ValueError as error:
+            parser.error(f"{path}: {error}")
+        scenarios.append((path, scenario))
+
+    os.makedirs(args.out, exist_ok=True)
+    for path, scenario in scenarios:
+        stem = os.path.splitext(os.path.basename(path))[0]
+
+        timer = PhaseTimer() if args.profile else None
+        start = time.perf_counter()
+        results, links, kpis = run_scenario(scenario, timer, record=not args.no_results)
+        elapsed = time.perf_counter() - start
+
+        options = {'links': scenario.get('links'), 'step_hours': scenario.get('step_hours')}
+        if scenario.get('dispatch', 'greedy') != 'greedy':
+            options['dispatch'] = scenario['dispatch']  # greedy runs keep the hash they had before dispatchers
+        summary = {
+            'scenario': path,
+            'config_hash': config_hash(scenario.get('iterations', DEFAULT_ITERATIONS), scenario['mps'], scenario.get('hub', scenario.get('hubs')), **options),
+            'iterations': scenario.get('iterations', DEFAULT_ITERATIONS),
+            'seconds': elapsed,
+            'systems': kpis.summary() if kpis is not None else summarize(results, scenario.get('step_hours')),
+        }
+        if timer is not None:
+            summary['profile'] = timer.to_dict()
+        if not args.no_results:
+            write_results(results, os.path.join(args.out, f"{stem}.{args.format}"), args.format)
+        if args.ensemble and 'hubs' in scenario:
+            print(f"{path}: weather ensembles need a single hub, skipped", file=sys.stderr)
+        elif args.ensemble:
+            from ensemble import run_ensemble
+            bands = run_ensemble(summary['iterations'], scenario['mps'], scenario['hub'], args.ensemble, args.seed, scenario.get('step_hours'))
+            np.savez(os.path.join(args.out, f"{stem}.ensemble.npz"), **{key: np.asarray(value) for key, value in bands.items()})
+            summary['ensemble'] = {'members': args.ensemble, 'seed': args.seed, 'percentiles': bands['percentiles'],
+                                   'min_soc': dict(zip(bands['names'], bands['min_soc'].T.tolist())),
+                                   'total_unserved': dict(zip(bands['names'], bands['total_unserved'].T.tolist()))}
+        if links is not None:
+            links.to_csv(os.path.join(args.out, f"{stem}.links.csv"), index=False)
+        with open(os.path.join(args.out, f"{stem}.summary.json"), 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"{path}: {summary['iterations']} iterations in {elapsed:.3f} s -> {args.out}", flush=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
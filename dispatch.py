@@ -0,0 +1,151 @@
+# dispatch.py
+
+import numpy as np
+from mps_class import CUTOFF_THRESHOLD, GRAPH_SCALE, TYPE_STD
+
+# Optimized hub dispatch: an alternative to the greedy MPS.update latching (power out = max_power - load /
+# power in = max_power once a SOC threshold and the POWER_*_MIN_TIME timer allow it), which assumes the hub
+# can take and give any amount.
+#
+# LPDispatcher plans the MPS <-> hub transfers of the next `horizon` steps as one sparse linear program over the
+# forecast solar / load (Fleet.forecast, i.e. the day profiles or measured series the fleet will read), applies
+# the first `replan_every` steps of the plan and then plans again from the battery levels actually reached
+# (rolling horizon). Per unit and step the variables are
+#   x_in, x_out   power from / to the hub (kW), x_out limited by max_power - local load like the greedy rule
+#   u             unserved load (kW): what the battery cannot supply, penalized heavily
+#   e             battery energy at the end of the step (kWh), 0 .. max_battery
+#   s             energy below the CUTOFF_THRESHOLD reserve (kWh), penalized
+# and the constraints are the battery balance (an inequality, so solar above a full battery is spilled as the
+# simulation clips it), the reserve and the hub throughput: at most the hub's max_power in each direction.
+# The hub is the last row of the same balance, fed by the sum of the unit transfers.
+#
+# Only the steps about to be applied are planned one by one; the rest of the horizon is planned in blocks of
+# `block` steps (average power over the block), which keeps the LP small enough for hundreds of units per window.
+# Every window has the same shape, so the constraint matrix is built once and only the right-hand side and
+# bounds change between windows. (linprog's HiGHS interface takes no starting basis, so the structure, not the
+# previous basis, is what carries over from one window to the next.)
+
+UNSERVED_COST = 1000.0  # per kWh of load not served
+RESERVE_COST = 10.0  # per kWh below the cutoff reserve and step
+TRANSFER_COST = 0.01  # per kWh moved over the hub link (no pointless round trips)
+STORED_VALUE = 0.1  # per kWh left in a battery at the end of the horizon
+
+VARIABLES = ['x_in', 'x_out', 'u', 'e', 's']
+
+class LPDispatcher:
+    def __init__(self, horizon=48, replan_every=6, block=4, hub_capacity=None):
+        if not 1 <= replan_every <= horizon:
+            raise ValueError(f"replan_every must be between 1 and the horizon ({horizon}), got {replan_every}")
+        self.horizon = horizon
+        self.replan_every = replan_every
+        # steps per planned period: one per step up to the next replan, then blocks
+        tail = horizon - replan_every
+        self.periods = np.array([1] * replan_every + [block] * (tail // block) + ([tail % block] if tail % block else []))
+        self.hub_capacity = hub_capacity  # kW each way, the hub's max_power by default
+        self.structure = None  # (units, step duration, constraint matrix, cost vector)
+        self.plan = None  # (x_in, x_out) of the planned steps, (unit, step)
+        self.plan_start = None
+        self.solves = 0
+
+    def _build(self, n, hub, step_duration):
+        # constraint matrix of n units (the hub is row `hub`) over the planned periods (of steps of step_duration
+        # hours), variables ordered (VARIABLES, unit, period); rows: battery balance (n*periods), reserve
+        # (n*periods), hub throughput (2*periods)
+        from scipy import sparse
+
+        horizon = len(self.periods)
+        size = n * horizon
+        def index(var, unit, step):
+            return VARIABLES.index(var) * size + unit * horizon + step
+
+        units = np.repeat(np.arange(n), horizon)
+        steps = np.tile(np.arange(horizon), n)
+        balance = units * horizon + steps
+        hours = step_duration * self.periods[steps]  # duration of each period
+        rows, cols, vals = [], [], []
+        def add(row, col, val):
+            rows.append(row)
+            cols.append(col)
+            vals.append(np.broadcast_to(val, np.shape(row)).astype(np.float64))
+
+        # e[t] - e[t-1] - h*(x_in - x_out + u) <= h*(solar - load)   (e[-1] is the current level, in the rhs)
+        add(balance, index('e', units, steps), 1.0)
+        later = steps > 0
+        add(balance[later], index('e', units[later], steps[later] - 1), -1.0)
+        add(balance, index('x_in', units, steps), -hours)
+        add(balance, index('x_out', units, steps), hours)
+        add(balance, index('u', units, steps), -hours)
+        # the hub row receives what the units send and sends what they receive
+        std = units != hub
+        add(hub * horizon + steps[std], index('x_out', units[std], steps[std]), -hours[std])
+        add(hub * horizon + steps[std], index('x_in', units[std], steps[std]), hours[std])
+        # -e - s <= -reserve
+        add(size + balance, index('e', units, steps), -1.0)
+        add(size + balance, index('s', units, steps), -1.0)
+        # sum x_in <= capacity, sum x_out <= capacity
+        add(2 * size + steps[std], index('x_in', units[std], steps[std]), 1.0)
+        add(2 * size + horizon + steps[std], index('x_out', units[std], steps[std]), 1.0)
+
+        matrix = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                                   shape=(2 * size + 2 * horizon, len(VARIABLES) * size))
+        cost = np.zeros(len(VARIABLES) * size)
+        cost[index('x_in', units[std], steps[std])] = TRANSFER_COST * hours[std]
+        cost[index('x_out', units[std], steps[std])] = TRANSFER_COST * hours[std]
+        cost[index('u', units, steps)] = UNSERVED_COST * hours
+        cost[index('s', units, steps)] = RESERVE_COST * self.periods[steps]
+        cost[index('e', np.arange(n), horizon - 1)] = -STORED_VALUE
+        return matrix, cost
+
+    def solve(self, fleet):
+        # plan the next `horizon` steps from the fleet's current state
+        from scipy.optimize import linprog
+
+        if len(fleet.hubs) != 1:
+            raise ValueError("LPDispatcher plans a single hub, use the greedy dispatch for networks")
+        n = len(fleet.names)
+        if self.structure is None or self.structure[:2] != (n, fleet.step_duration):
+            self.structure = (n, fleet.step_duration, *self._build(n, fleet.hub, fleet.step_duration))
+        _, _, matrix, cost = self.structure
+
+        # forecast per period: energy over the period, power limits as averages
+        solar, load = fleet.forecast(fleet.iteration, self.horizon)
+        starts = np.concatenate([[0], np.cumsum(self.periods)[:-1]])
+        horizon = len(self.periods)
+        size = n * horizon
+        reserve = fleet.max_battery * (CUTOFF_THRESHOLD / 100)
+        capacity = self.hub_capacity if self.hub_capacity is not None else fleet.max_power[fleet.hub]
+        net = np.add.reduceat(solar - load, starts, axis=1) * fleet.step_duration
+        net[:, 0] += fleet.remaining_battery
+        rhs = np.concatenate([net.ravel(), -np.repeat(reserve, horizon), np.full(2 * horizon, capacity)])
+
+        std = (fleet.mps_type == TYPE_STD)[:, None]
+        x_max = np.where(std, fleet.max_power[:, None], 0.0) * np.ones((1, horizon))
+        out_max = np.where(std, np.add.reduceat(np.maximum(fleet.max_power[:, None] - load, 0.0), starts, axis=1) / self.periods, 0.0)
+        upper = np.concatenate([x_max.ravel(), out_max.ravel(), np.full(size, np.inf),
+                                np.repeat(fleet.max_battery, horizon), np.full(size, np.inf)])
+        bounds = np.column_stack([np.zeros_like(upper), upper])
+
+        result = linprog(cost, A_ub=matrix, b_ub=rhs, bounds=bounds, method='highs')
+        if result.status != 0:
+            raise ValueError(f"dispatch LP failed at iteration {fleet.iteration}: {result.message}")
+        self.solves += 1
+        x = result.x.reshape(len(VARIABLES), n, horizon)
+        x[np.abs(x) < 1e-9] = 0.0  # solver round-off, not a transfer
+        self.plan = (x[VARIABLES.index('x_in')], x[VARIABLES.index('x_out')])
+        self.plan_start = fleet.iteration
+
+    def dispatch(self, fleet):
+        # set the power in / out of the current step (called by Fleet.step instead of the greedy rules)
+        if self.plan is None or fleet.iteration - self.plan_start >= self.replan_every:
+            self.solve(fleet)
+        step = fleet.iteration - self.plan_start
+        x_in, x_out = self.plan[0][:, step], self.plan[1][:, step]
+        units = fleet.mps_type == TYPE_STD
+        power_in = np.where(units, x_in, 0.0)
+        power_out = np.where(units, x_out, 0.0)
+        power_in[fleet.hub] = power_out[units].sum()
+        power_out[fleet.hub] = power_in[units].sum()
+        fleet.power_in = power_in
+        fleet.power_out = power_out
+        fleet.power_in_allowed = np.where(power_in > 0, 1*GRAPH_SCALE, 0)
+        fleet.power_out_allowed = np.where(power_out > 0, 1*GRAPH_SCALE, 0)
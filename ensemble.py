@@ -0,0 +1,136 @@
+# ensemble.py
+
+import numpy as np
+from mps_class import LOAD_START
+from fleet_class import Fleet
+from profile_cache import solar_profiles, profile_hours, steps_per_day
+from solar_input_class import SOLAR_GAIN
+
+# Stochastic weather ensembles: many seeded variants of the solar / load inputs, simulated together.
+#
+# weather_ensemble draws (member, unit, step) solar input and local load arrays:
+#   solar  the clear-sky profile scaled by a day type per member and day (clear / partly cloudy / overcast,
+#          a Markov chain, so cloudy stretches last several days) and by cloud flicker within the day;
+#          every unit of a member sees the same sky
+#   load   each unit's load switched on and off at randomly shifted times every day, with multiplicative noise
+# run_ensemble advances all members at once as one flattened fleet (member-major rows, one hub per member fed by
+# its own units) and reduces the trajectories to percentile bands over the members, a chunk of steps at a time.
+
+# day types: clear, partly cloudy, overcast
+TRANSITIONS = np.array([
+    [0.70, 0.20, 0.10],
+    [0.30, 0.40, 0.30],
+    [0.20, 0.30, 0.50],
+])
+CLEARNESS = np.array([1.0, 0.65, 0.25])  # mean fraction of the clear-sky output
+CLOUD_SPREAD = np.array([0.05, 0.30, 0.15])  # log-normal spread of the output within the day
+LOAD_SHIFT_HOURS = 1.0  # standard deviation of the daily load start time
+LOAD_DURATION_HOURS = 1.0  # standard deviation of the daily load duration
+LOAD_NOISE = 0.1  # standard deviation of the multiplicative load noise
+
+PERCENTILES = (5, 25, 50, 75, 95)
+ENSEMBLE_CHUNK = 48 * 7  # steps recorded at a time before reducing to percentiles
+
+def day_types(members, days, rng):
+    # (member, day) Markov chain of day types, starting from its stationary distribution
+    values, vectors = np.linalg.eig(TRANSITIONS.T)
+    stationary = np.real(vectors[:, np.argmax(np.real(values))])
+    stationary /= stationary.sum()
+    cumulative = np.cumsum(TRANSITIONS, axis=1)
+    types = np.empty((members, days), dtype=np.intp)
+    types[:, 0] = np.searchsorted(np.cumsum(stationary), rng.random(members), side='right')
+    for day in range(1, days):
+        types[:, day] = (rng.random(members)[:, None] > cumulative[types[:, day - 1]]).sum(axis=1)
+    return np.minimum(types, len(CLEARNESS) - 1)
+
+def weather_ensemble(members, iterations, configs, step_hours=None, seed=0):
+    # (solar input, local load) arrays of shape (member, unit, step) for the units of `configs`, as the fleet reads
+    # them (solar already multiplied by SOLAR_GAIN)
+    rng = np.random.default_rng(seed)
+    per_day = steps_per_day(step_hours)
+    days = -(-iterations // per_day)
+    day = np.arange(iterations) // per_day
+    hours = profile_hours(step_hours)[np.arange(iterations) % per_day]
+
+    column = lambda key: np.array([config[key] for config in configs], dtype=np.float64)
+    clear_sky = SOLAR_GAIN * solar_profiles(column('max_solar'), column('peak_sun_hours'), iterations, step_hours)
+    types = day_types(members, days, rng)[:, day]  # (member, step)
+    spread = CLOUD_SPREAD[types]
+    sky = CLEARNESS[types] * np.exp(spread * rng.standard_normal((members, iterations)) - spread**2 / 2)
+    solar = clear_sky[None, :, :] * np.clip(sky, 0.0, 1.0)[:, None, :]
+
+    units = len(configs)
+    start = LOAD_START + LOAD_SHIFT_HOURS * rng.standard_normal((members, units, days))
+    end = start + np.maximum(column('load_hours')[None, :, None] + LOAD_DURATION_HOURS * rng.standard_normal((members, units, days)), 0.0)
+    on = (hours >= start[:, :, day]) & (hours < end[:, :, day])
+    noise = np.maximum(1.0 + LOAD_NOISE * rng.standard_normal((members, units, iterations)), 0.0)
+    load = np.where(on, column('load_power')[None, :, None] * noise, 0.0)
+    return solar, load
+
+class EnsembleFleet(Fleet):
+    # every member's units (member-major) followed by one hub per member, reading the ensemble inputs
+    def __init__(self, mps_configs, hub_config, solar, load, step_hours=None, timer=None):
+        if any(config.get('solar_series') is not None or config.get('load_series') is not None for config in list(mps_configs) + [hub_config]):
+            raise ValueError("weather ensembles replace the solar / load profiles, measured series cannot be used")
+        members, units, iterations = solar.shape
+        self.members = members
+        self.units = units - 1  # MPS per member
+        configs = [dict(config, name=f"{config['name']}#{m}") for m in range(members) for config in mps_configs]
+        hubs = [dict(hub_config, name=f"{hub_config['name']}#{m}") for m in range(members)]
+        super().__init__(configs, hubs, step_hours, timer=timer)
+        # the whole horizon as the "day" table: step() reads column `iteration`
+        self.solar_table = self.rows(solar) / SOLAR_GAIN
+        self.load_table = self.rows(load)
+
+    def rows(self, values):
+        # (member, unit, ...) -> fleet rows (..., the hubs last)
+        return np.concatenate([values[:, :-1].reshape(self.members * self.units, *values.shape[2:]), values[:, -1]])
+
+    def members_of(self, values):
+        # fleet rows (row, ...) -> (member, unit, ...), the hub last in every member
+        units = values[:self.members * self.units].reshape(self.members, self.units, *values.shape[1:])
+        return np.concatenate([units, values[self.members * self.units:, None]], axis=1)
+
+    def _link(self):
+        # every hub takes the transfers of its own member's units
+        units = slice(0, self.members * self.units)
+        self.power_in[self.hubs] = self.power_out[units].reshape(self.members, self.units).sum(axis=1)
+        self.power_out[self.hubs] = self.power_in[units].reshape(self.members, self.units).sum(axis=1)
+
+def run_ensemble(iterations, mps_configs, hub_config, members=100, seed=0, step_hours=None, percentiles=PERCENTILES, weather=None, timer=None):
+    # percentile bands over the members, per system (MPS in config order, the hub last) and step:
+    #   soc       SOC (%)
+    #   unserved  load the battery could not supply since the start, kWh (growth of the deficit below empty)
+    # plus min_soc / total_unserved (percentile, system) over the whole run. weather: (solar, load) arrays
+    # from weather_ensemble, drawn with `members` and `seed` if not given.
+    configs = list(mps_configs) + [hub_config]
+    if weather is None:
+        weather = weather_ensemble(members, iterations, configs, step_hours, seed)
+    solar, load = weather
+    fleet = EnsembleFleet(mps_configs, hub_config, solar, load, step_hours, timer=timer)
+    kpis = fleet.track_kpis()
+
+    names = [config['name'] for config in configs]
+    soc = np.empty((len(percentiles), len(configs), iterations))
+    unserved = np.empty((len(percentiles), len(configs), iterations))
+    deficit = np.maximum(-fleet.remaining_battery, 0.0)
+    total = np.zeros(len(fleet.names))
+    while fleet.iteration < iterations:
+        start = fleet.iteration
+        fleet.run(min(ENSEMBLE_CHUNK, iterations - start), variables=['soc', 'remaining_battery'])
+        chunk = slice(start, fleet.iteration)
+        soc[:, :, chunk] = np.percentile(fleet.members_of(fleet.results[0]), percentiles, axis=0)
+        deficits = np.maximum(-fleet.results[1], 0.0)
+        growth = np.maximum(np.diff(deficits, axis=1, prepend=deficit[:, None]), 0.0)
+        cumulative = total[:, None] + np.cumsum(growth, axis=1)
+        unserved[:, :, chunk] = np.percentile(fleet.members_of(cumulative), percentiles, axis=0)
+        deficit, total = deficits[:, -1], cumulative[:, -1]
+    return {
+        'names': names,
+        'percentiles': list(percentiles),
+        'members': solar.shape[0],
+        'soc': soc,
+        'unserved': unserved,
+        'min_soc': np.percentile(fleet.members_of(kpis.min_soc), percentiles, axis=0),
+        'total_unserved': np.percentile(fleet.members_of(kpis.unserved), percentiles, axis=0),
+    }
@@ -0,0 +1,323 @@
+# fleet_class.py
+
+import hashlib
+import io
+import json
+import numpy as np
+from mps_class import (
+    POWER_IN_THRESHOLD, POWER_OUT_THRESHOLD, HUB_POWER_IN_THRESHOLD, HUB_POWER_OUT_THRESHOLD,
+    LOAD_START, TYPE_STD, TYPE_HUB, POWER_OUT_MIN_TIME, POWER_IN_MIN_TIME, GRAPH_SCALE, step_duration,
+)
+from profile_cache import solar_table, load_table
+from measured_series import MeasuredSeries, series_from_config, series_step_hours
+from results_recorder_class import RESULT_VARIABLES, allocate_results
+from kpis import FleetKPIs
+from profiling import phase
+
+# Fleet class advances every MPS of a simulation (and the hub) at once.
+# Each MPS field is kept as one numpy array indexed by unit (struct of arrays), and every interval
+# applies the MPS.update rules to all units with vectorized operations.
+
+# everything the next step depends on (the other fields are recomputed every step)
+STATE_VARIABLES = ["soc", "remaining_battery", "power_in", "power_out", "power_in_allowed", "power_out_allowed", "power_in_timer", "power_out_timer"]
+
+SERIES_BLOCK = 48 * 7  # steps of measured input read at a time
+
+def _json_value(value):
+    # numpy numbers, and measured series by the spec of the file they were opened from
+    if isinstance(value, MeasuredSeries):
+        if value.spec is None:
+            raise ValueError("a snapshot can only refer to measured series opened from a file")
+        return value.spec
+    return float(value)
+
+class Fleet:
+    def __init__(self, mps_configs, hub_config, step_hours=None, timer=None):
+        # the hub is stored as the last unit (a list of hub configs puts every hub at the end, see topology.Network)
+        hub_configs = list(hub_config) if isinstance(hub_config, (list, tuple)) else [hub_config]
+        configs = list(mps_configs) + hub_configs
+        self.configs = configs
+        self.names = [config['name'] for config in configs]
+        self.hubs = np.arange(len(configs) - len(hub_configs), len(configs))
+        self.hub = len(configs) - 1
+        self.iteration = 0
+        self.timer = timer  # optional profiling.PhaseTimer
+
+        self.mps_type = np.full(len(configs), TYPE_STD)
+        self.mps_type[self.hubs] = TYPE_HUB
+        self.max_power = self._column(configs, 'max_power')
+        self.max_battery = self._column(configs, 'max_battery')
+        self.soc = self._column(configs, 'init_soc')
+        self.remaining_battery = self.max_battery * (self.soc / 100)
+
+        # day profiles, one row per unit, read by slicing the column of the current step
+        self.step_hours = step_hours
+        self.step_duration = step_duration(step_hours)  # hours per iteration
+        self.solar_table = solar_table(self._column(configs, 'max_solar'), self._column(configs, 'peak_sun_hours'), step_hours)
+        self.load_table = load_table(self._column(configs, 'load_power'), [LOAD_START] * len(configs), LOAD_START + self._column(configs, 'load_hours'), step_hours)
+        # measured series replace the day profile of the units that have one, read a block of steps at a time
+        self.solar_series = self._series(configs, 'solar_series')
+        self.load_series = self._series(configs, 'load_series')
+        self.series_start = None
+
+        is_hub = self.mps_type == TYPE_HUB
+        self.power_in_threshold = np.where(is_hub, HUB_POWER_IN_THRESHOLD, POWER_IN_THRESHOLD)
+        self.power_out_threshold = np.where(is_hub, HUB_POWER_OUT_THRESHOLD, POWER_OUT_THRESHOLD)
+
+        n = len(configs)
+        self.bat_charge = np.zeros(n)
+        self.bat_discharge = np.zeros(n)
+        self.local_load = np.zeros(n)
+        self.solar_input = np.zeros(n)
+        self.power_in = np.zeros(n)
+        self.power_out = np.zeros(n)
+        self.served_in = self.power_in
+        self.served_out = self.power_out
+        self.power_in_allowed = np.zeros(n, dtype=np.int64)
+        self.power_out_allowed = np.zeros(n, dtype=np.int64)
+        self.power_in_timer = np.zeros(n, dtype=np.int64)
+        self.power_out_timer = np.zeros(n, dtype=np.int64)
+        self.results = None  # (variable, unit, iteration) buffer while recording
+        self.recorders = []
+        self.record_start = 0
+        self.prefix = None  # (results, variables) restored from a snapshot, prepended to the next recorded run
+        self.checkpoints = {}  # iteration -> state, taken by run(checkpoint_every=...)
+        self.kpis = None  # kpis.FleetKPIs updated every step, see track_kpis()
+        self.dispatcher = None  # sets power in / out instead of the greedy rules (e.g. dispatch.LPDispatcher)
+
+    @staticmethod
+    def _column(configs, key):
+        return np.array([config[key] for config in configs], dtype=np.float64)
+
+    @staticmethod
+    def _series(configs, key):
+        # (units, their MeasuredSeries) of the configs with a `key` entry, None if there are none
+        units = [i for i, config in enumerate(configs) if config.get(key) is not None]
+        if not units:
+            return None
+        return np.array(units), [series_from_config(configs[i][key]) for i in units]
+
+    def _series_block(self, measured, start):
+        # (units, SERIES_BLOCK) inputs of the measured units, each distinct series (by spec) read once
+        units, series = measured
+        blocks = {}
+        for item in series:
+            if item.key not in blocks:
+                blocks[item.key] = item.block(start, SERIES_BLOCK, series_step_hours(self.step_hours))
+        return np.array([blocks[item.key] for item in series])
+
+    def _read_series(self, iteration):
+        if self.series_start is None or not self.series_start <= iteration < self.series_start + SERIES_BLOCK:
+            self.series_start = iteration
+            self.solar_block = self._series_block(self.solar_series, iteration) if self.solar_series else None
+            self.load_block = self._series_block(self.load_series, iteration) if self.load_series else None
+        column = iteration - self.series_start
+        if self.solar_series:
+            self.solar_input[self.solar_series[0]] = self.solar_block[:, column]
+        if self.load_series:
+            self.local_load = self.local_load.copy()  # not a view of the day table any more
+            self.local_load[self.load_series[0]] = self.load_block[:, column]
+
+    def step(self):
+        iteration = self.iteration
+
+        # count the power timers down
+        np.subtract(self.power_out_timer, 1, out=self.power_out_timer, where=self.power_out_timer > 0)
+        np.subtract(self.power_in_timer, 1, out=self.power_in_timer, where=self.power_in_timer > 0)
+
+        # new local load and solar power values (same day wrap as LoadOutput / SolarInput)
+        step = iteration % self.solar_table.shape[1]
+        self.local_load = self.load_table[:, step]
+        self.solar_input = 4*self.solar_table[:, step]
+        if self.solar_series or self.load_series:
+            self._read_series(iteration)
+
+        if self.dispatcher is not None:
+            with phase(self.timer, 'dispatch'):
+                self.dispatcher.dispatch(self)
+        else:
+            # update power out: units above the threshold latch a new value when their timer has run out
+            out_ok = self.soc > self.power_out_threshold
+            out_latch = out_ok & (self.power_out_timer == 0)
+            self.power_out_allowed = np.where(out_latch, 1*GRAPH_SCALE, np.where(out_ok, self.power_out_allowed, 0))
+            self.power_out = np.where(out_latch, self.max_power - self.local_load, np.where(out_ok, self.power_out, 0.0))
+            self.power_out_timer[out_latch] = POWER_OUT_MIN_TIME
+
+            # update power in
+            in_ok = self.soc < self.power_in_threshold
+            in_latch = in_ok & (self.power_in_timer == 0)
+            self.power_in_allowed = np.where(in_latch, 1*GRAPH_SCALE, np.where(in_ok, self.power_in_allowed, 0))
+            self.power_in = np.where(in_latch, self.max_power, np.where(in_ok, self.power_in, 0.0))
+            self.power_in_timer[in_latch] = POWER_IN_MIN_TIME
+        self._serve_transfers()
+
+        # update battery charge and discharge
+        self.bat_charge = self.solar_input + np.where(self.power_in_allowed > 0, self.served_in, 0.0)
+        self.bat_discharge = self.local_load + np.where(self.power_out_allowed > 0, self.served_out, 0.0)
+
+        # update remaining capacity and soc
+        self.remaining_battery = np.minimum(self.remaining_battery + (self.bat_charge - self.bat_discharge) * self.step_duration, self.max_battery)
+        self.soc = (self.remaining_battery / self.max_battery) * 100
+
+        if self.results is not None:
+            column = iteration - self.record_start
+            for row, var in enumerate(self.recorders[0].variables):
+                self.results[row, :, column] = getattr(self, var)
+        if self.kpis is not None:
+            self.kpis.update(self)
+
+        with phase(self.timer, 'hub aggregation'):
+            self._link()
+        self.iteration += 1
+
+    def forecast(self, start, count):
+        # (solar input, local load) of the steps start .. start + count - 1 as step() will read them, (unit, step)
+        columns = np.arange(start, start + count) % self.period
+        solar = 4*self.solar_table[:, columns]
+        load = self.load_table[:, columns]
+        step_hours = series_step_hours(self.step_hours)
+        for measured, values in ((self.solar_series, solar), (self.load_series, load)):
+            if measured:
+                units, series = measured
+                values[units] = [item.block(start, count, step_hours) for item in series]
+        return solar, load
+
+    def _serve_transfers(self):
+        # the part of power_in / power_out the connection carries this step, into the batteries: all of it in a
+        # star (topology.Network cuts it to the link capacities)
+        self.served_in = self.power_in
+        self.served_out = self.power_out
+
+    def _link(self):
+        # link MPS outputs to hub inputs (read by the hub on the next step)
+        units = self.mps_type == TYPE_STD
+        self.power_in[self.hub] = self.power_out[units].sum()
+        self.power_out[self.hub] = self.power_in[units].sum()
+
+    @property
+    def period(self):
+        # steps per day of the input profiles
+        return self.solar_table.shape[1]
+
+    def state_digest(self):
+        digest = hashlib.blake2b(digest_size=16)
+        for var in STATE_VARIABLES:
+            digest.update(np.ascontiguousarray(getattr(self, var)).data)
+        return digest.digest()
+
+    def run(self, iterations, record=True, variables=RESULT_VARIABLES, dtype=np.float64, fast_forward=False, checkpoint_every=None):
+        # fast_forward: the inputs repeat every day, so once the whole fleet state at the start of a day
+        # equals the state at the start of an earlier day, the run is periodic from there on. The remaining
+        # whole cycles are then filled in by replaying the recorded cycle instead of being stepped.
+        # checkpoint_every: keep the state every that many iterations (e.g. self.period), see snapshot().
+        # Measured series do not repeat daily, and a dispatcher plans on its own schedule, so such runs never fast-forward.
+        fast_forward = fast_forward and not (self.solar_series or self.load_series or self.dispatcher)
+        if record:
+            prefix = self._take_prefix(variables)
+            self.record_start = self.iteration - prefix.shape[2]
+            self.results, self.recorders = allocate_results(self.names, prefix.shape[2] + iterations, variables, dtype)
+            self.results[:, :, :prefix.shape[2]] = prefix
+        else:
+            self.results, self.recorders = None, []
+        self.prefix = None
+
+        end = self.iteration + iterations
+        seen = {}  # state digest at the start of a day -> (iteration, KPI state)
+        stepped = 0
+        while self.iteration < end:
+            if checkpoint_every and self.iteration % checkpoint_every == 0:
+                self.checkpoints[self.iteration] = self._state()
+            if fast_forward and self.iteration % self.period == 0:
+                digest = self.state_digest()
+                if digest in seen:
+                    start, kpis = seen[digest]
+                    cycle = self.iteration - start
+                    skip = ((end - self.iteration) // cycle) * cycle
+                    self._fast_forward(cycle, skip)
+                    if self.kpis is not None:
+                        self.kpis.repeat(kpis, skip // cycle)
+                    fast_forward = False
+                    continue
+                seen[digest] = (self.iteration, self.kpis.state() if self.kpis is not None else None)
+            self.step()
+            stepped += 1
+
+        if self.timer is not None:
+            self.timer.count('steps', stepped)
+            self.timer.count('unit_steps', stepped * len(self.names))
+            self.timer.count('fast_forward_steps', iterations - stepped)
+
+    def track_kpis(self, kpis=None):
+        # accumulate KPIs (a kpis.FleetKPIs, new by default) from the current state on, recorded or not
+        self.kpis = (kpis if kpis is not None else FleetKPIs()).attach(self)
+        return self.kpis
+
+    def _fast_forward(self, cycle, skip):
+        # the state is the same as `cycle` steps ago, so every later step repeats the last cycle
+        if self.results is not None:
+            start = self.iteration - self.record_start
+            source = self.results[:, :, start - cycle:start]
+            for offset in range(0, skip, cycle):
+                self.results[:, :, start + offset:start + offset + cycle] = source
+        self.iteration += skip
+
+    def _take_prefix(self, variables):
+        if self.prefix is None:
+            return np.zeros((len(variables), len(self.names), 0))
+        results, saved = self.prefix
+        missing = [var for var in variables if var not in saved]
+        if missing:
+            raise ValueError(f"snapshot has no recorded {missing}")
+        return results[[saved.index(var) for var in variables]]
+
+    def _state(self):
+        state = {var: np.copy(getattr(self, var)) for var in STATE_VARIABLES}
+        state['iteration'] = self.iteration
+        return state
+
+    def snapshot(self, iteration=None, results=True):
+        # compact binary (npz) of the fleet at the current iteration, or at a checkpoint taken by run():
+        # state, configs and, with results=True, everything recorded up to that iteration
+        state = self._state() if iteration is None else self.checkpoints[iteration]
+        arrays = dict(state, configs=json.dumps({'configs': self.configs, 'hubs': len(self.hubs), 'step_hours': self.step_hours}, default=_json_value))
+        if results and self.results is not None:
+            arrays['results'] = self.results[:, :, :state['iteration'] - self.record_start]
+            arrays['variables'] = np.array(self.recorders[0].variables)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def restore(cls, data, mps_configs=None, hub_config=None, timer=None):
+        # Fleet continuing from a snapshot. New mps_configs / hub_config branch the run with other
+        # parameters from the snapshot iteration on (same systems, the state is kept as saved).
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            saved = json.loads(str(arrays['configs']))
+            hubs = saved['hubs']
+            if mps_configs is None:
+                mps_configs = saved['configs'][:-hubs]
+            if hub_config is None:
+                hub_config = saved['configs'][-hubs:] if hubs > 1 else saved['configs'][-1]
+            fleet = cls(mps_configs, hub_config, saved['step_hours'], timer=timer)
+            if fleet.names != [config['name'] for config in saved['configs']]:
+                raise ValueError("a branch must keep the systems of the snapshot")
+            for var in STATE_VARIABLES:
+                getattr(fleet, var)[:] = arrays[var]
+            fleet.iteration = int(arrays['iteration'])
+            if 'results' in arrays:
+                fleet.prefix = (arrays['results'], [str(var) for var in arrays['variables']])
+        return fleet
+
+    def get_results(self, hub_names=False):
+        # one ResultsRecorder per system, keyed like run_simulation ('hub' first; hubs by name when there are
+        # several, or with hub_names)
+        for recorder in self.recorders:
+            recorder.length = self.iteration - self.record_start
+        if len(self.hubs) == 1 and not hub_names:
+            results = {'hub': self.recorders[self.hub]}
+        else:
+            results = {self.names[i]: self.recorders[i] for i in self.hubs}
+        for i, recorder in enumerate(self.recorders):
+            if self.mps_type[i] != TYPE_HUB:
+                results[recorder.name] = recorder
+        return results
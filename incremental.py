@@ -0,0 +1,136 @@
+# incremental.py
+
+import json
+import threading
+import numpy as np
+from cachetools import LRUCache
+from fleet_class import Fleet
+from results_recorder_class import RESULT_VARIABLES, allocate_results
+from profiling import phase
+
+# Incremental re-simulation. A standard MPS never reads hub state (only the hub consumes the summed power_out /
+# power_in of the units), so every unit's trajectory depends on its own config and the horizon alone.
+# IncrementalRunner caches each unit's trajectory under its config and the horizon, and keeps the hub aggregate
+# of its last run. A run subtracts the old contribution of every unit that changed from that aggregate and steps
+# only the changed units together with the hub (DeltaFleet), the hub fed the remaining aggregate plus the changed
+# units' power. Changing one of many units costs one unit's simulation plus the hub's, not the fleet's.
+#
+# The unit trajectories are exactly those of run_simulation, and so is the hub of a run that simulates every unit.
+# After that the aggregate is updated by subtractions and additions, so the hub can differ from a full run in the
+# last bits; the aggregate is summed afresh whenever the set of units or the horizon changes, and every
+# REBUILD_EVERY incremental updates. With the vectorized fleet a step of one unit costs nearly as much as a step
+# of a small fleet, so the saving grows with the fleet size.
+
+UNIT_CACHE_BYTES = 256 * 2**20
+REBUILD_EVERY = 64  # incremental aggregate updates before it is summed afresh
+LINK_VARIABLES = ['power_in', 'power_out']  # always kept: the hub aggregate is made of them
+
+def _nbytes(trajectory):
+    return trajectory.nbytes
+
+def _frozen(config):
+    # hashable form of a config; numbers compare equal whatever their type (like simulation.config_hash)
+    return tuple(sorted(
+        (key, float(value) if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+         else json.dumps(value, sort_keys=True, default=str))
+        for key, value in config.items()
+    ))
+
+class DeltaFleet(Fleet):
+    # some units and the hub; the hub is fed `base` ((power in, power out) per iteration of the units that are not
+    # stepped here) plus the power of the units that are
+    def __init__(self, mps_configs, hub_config, step_hours, base):
+        super().__init__(mps_configs, hub_config, step_hours)
+        self.base = base
+
+    def _link(self):
+        super()._link()
+        self.power_in[self.hub] += self.base[0][self.iteration]
+        self.power_out[self.hub] += self.base[1][self.iteration]
+
+class IncrementalRunner:
+    def __init__(self, step_hours=None, variables=RESULT_VARIABLES, dtype=np.float64, max_bytes=UNIT_CACHE_BYTES):
+        self.step_hours = step_hours
+        self.variables = list(variables)
+        self.dtype = dtype
+        self.recorded = self.variables + [var for var in LINK_VARIABLES if var not in self.variables]
+        self.units = LRUCache(maxsize=max_bytes, getsizeof=_nbytes)  # unit key -> (recorded variable, iteration)
+        self.last = None  # (iterations, unit keys, hub power in, hub power out, updates since summed) of the last run
+        self.lock = threading.Lock()
+        self.simulated = 0  # units stepped by the last run
+
+    def unit_key(self, iterations, config):
+        return iterations, _frozen(config)
+
+    def missing(self, iterations, mps_configs):
+        # configs whose trajectory is not cached (what run() would simulate)
+        with self.lock:
+            return [config for config in mps_configs if self.unit_key(iterations, config) not in self.units]
+
+    def seed(self, iterations, mps_configs, results):
+        # cache the unit trajectories of a run (run_simulation-like results recording at least self.recorded,
+        # with the runner's step size)
+        with self.lock:
+            for config in mps_configs:
+                data = results[config['name']]
+                self.units[self.unit_key(iterations, config)] = np.stack([np.asarray(data[var], dtype=self.dtype) for var in self.recorded])
+
+    def _base(self, iterations, keys, cached):
+        # hub power in / out from the units at the `cached` positions: the last run's aggregate with every unit that
+        # changed since swapped out (and its new config's trajectory swapped in when that is cached; the others are
+        # stepped by the run), or summed afresh (per step over the units, like Fleet._link)
+        out_row, in_row = self.recorded.index('power_out'), self.recorded.index('power_in')
+        last = self.last
+        if last is not None and last[0] == iterations and len(last[1]) == len(keys) and last[4] < REBUILD_EVERY:
+            changed = [i for i, (old, new) in enumerate(zip(last[1], keys)) if old != new or i not in cached]
+            if all(last[1][i] in self.units for i in changed):
+                hub_in, hub_out = last[2].copy(), last[3].copy()
+                for i in changed:
+                    old = self.units[last[1][i]]
+                    hub_in -= old[out_row]
+                    hub_out -= old[in_row]
+                    if i in cached:
+                        hub_in += cached[i][out_row]
+                        hub_out += cached[i][in_row]
+                return hub_in, hub_out, last[4] + bool(changed)
+        if not cached:
+            return np.zeros(iterations), np.zeros(iterations), 0
+        stacked = np.stack([cached[i] for i in sorted(cached)], axis=-1)  # (variable, iteration, unit)
+        return stacked[out_row].sum(axis=1), stacked[in_row].sum(axis=1), 0
+
+    def run(self, iterations, mps_configs, hub_config, timer=None):
+        # run_simulation-like results ('hub' first, then the units in config order)
+        with self.lock:
+            keys = [self.unit_key(iterations, config) for config in mps_configs]
+            # trajectories by position, held here so that cache evictions cannot drop them mid-run
+            cached = {i: self.units[key] for i, key in enumerate(keys) if key in self.units}
+            new = [i for i in range(len(keys)) if i not in cached]
+            self.simulated = len(new)
+
+            with phase(timer, 'hub aggregation'):
+                base_in, base_out, updates = self._base(iterations, keys, cached)
+            with phase(timer, 'step loop'):
+                fleet = DeltaFleet([mps_configs[i] for i in new], hub_config, self.step_hours, (base_in, base_out))
+                fleet.run(iterations, variables=self.recorded, dtype=self.dtype)
+            trajectories = dict(cached)
+            for row, i in enumerate(new):
+                trajectories[i] = self.units[keys[i]] = fleet.results[:, row, :].copy()
+            hub = fleet.results[:, fleet.hub, :]
+            if new:
+                changed = np.stack([trajectories[i] for i in new], axis=-1)
+                base_in = base_in + changed[self.recorded.index('power_out')].sum(axis=1)
+                base_out = base_out + changed[self.recorded.index('power_in')].sum(axis=1)
+            self.last = (iterations, keys, base_in, base_out, updates)
+
+        names = [hub_config['name']] + [config['name'] for config in mps_configs]
+        buffer, recorders = allocate_results(names, iterations, self.variables, self.dtype)
+        rows = [self.recorded.index(var) for var in self.variables]
+        buffer[:, 0, :] = hub[rows]
+        for i in range(len(keys)):
+            buffer[:, i + 1, :] = trajectories[i][rows]
+        for recorder in recorders:
+            recorder.length = iterations
+        results = {'hub': recorders[0]}
+        for config, recorder in zip(mps_configs, recorders[1:]):
+            results[config['name']] = recorder
+        return results
@@ -0,0 +1,313 @@
+# job_service.py
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+import requests
+import tornado.ioloop
+import tornado.log
+import tornado.web
+from simulation import config_hash
+from background import SimulationJob
+from result_store import ResultStore, DEFAULT_STORE_URL
+from profiling import PhaseTimer
+
+# Local simulation job service, shared by every dashboard process and session (tornado, one process).
+#
+#   python job_service.py --port 8765 --workers 2
+#
+# Clients POST a configuration to /jobs and poll /jobs/<config_hash>; finished runs are written to the shared
+# ResultStore (result_store.DEFAULT_STORE_URL, so point MPS_RESULT_STORE of the service and the dashboards at the
+# same database) and read from there, the service never sends trajectories. A configuration that is already
+# stored is done at once, and one that is queued or running is not started again: every client asking for it
+# gets the same job (the config_hash is the job id).
+# At most `workers` jobs run at a time (SimulationJob threads, saving to the store when they finish), the others
+# wait in a priority queue: lower priority values first, then the job of the client with the fewest jobs queued
+# or running when it was submitted (so one analyst's batch does not hold back everybody else), then submission
+# order. All scheduling state lives on the IOLoop thread.
+#
+# ServiceRegistry is the client side: a drop-in for background.JobRegistry whose jobs are RemoteJobs.
+# The dashboard uses it when MPS_JOB_SERVICE is set to the service URL.
+
+SERVICE_URL = os.environ.get('MPS_JOB_SERVICE')
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+SCHEDULE_INTERVAL_MS = 200  # how often finished jobs are collected and queued ones started
+FINISHED_JOBS = 256  # finished / failed / cancelled jobs whose status is kept
+PRIORITY_INTERACTIVE = 0  # dashboard runs
+PRIORITY_BATCH = 10  # scripted runs, after every waiting dashboard run
+REQUEST_TIMEOUT = 10.0  # seconds, client requests
+POLL_INTERVAL = 0.2  # seconds between status requests of RemoteJob.join
+
+class StoredJob(SimulationJob):
+    # a SimulationJob that writes its results to the store when it ran to the end
+    def __init__(self, store, key, *args, **kwargs):
+        super().__init__(key, *args, **kwargs)
+        self.store = store
+        self.started = False
+        self.stored = False
+
+    def start(self):
+        self.started = True
+        return super().start()
+
+    def _run(self):
+        super()._run()
+        if self.error is None and not self.cancelled and self.done == self.iterations:
+            try:
+                self.store.save(self.key, self.results(), {'mps_configs': self.mps_configs, 'hub_config': self.hub_config})
+                self.stored = True
+            except Exception as error:
+                self.error = error
+
+    @property
+    def state(self):
+        if not self.started:
+            return 'cancelled' if self.cancelled else 'queued'
+        if self.running:
+            return 'running'
+        if self.stored:
+            return 'done'
+        return 'cancelled' if self.cancelled and self.error is None else 'failed'
+
+class Scheduler:
+    def __init__(self, store, workers=DEFAULT_WORKERS):
+        self.store = store
+        self.workers = workers
+        self.jobs = OrderedDict()  # config hash -> StoredJob, in submission order
+        self.pending = {}  # config hash -> (client, sequence) of the queued and running jobs
+        self.queue = []  # heap of (priority, client jobs pending at submission, sequence, config hash)
+        self.sequence = itertools.count()
+
+    def submit(self, iterations, mps_configs, hub_config, priority=PRIORITY_INTERACTIVE, client=None):
+        # status of the configuration's job, queued unless it is stored, queued or running already
+        key = config_hash(iterations, mps_configs, hub_config)
+        job = self.jobs.get(key)
+        if job is not None and job.state in ('queued', 'running', 'done'):
+            return self.status(key)
+        if self.store.has(key):
+            return {'key': key, 'state': 'done', 'done': iterations, 'iterations': iterations, 'position': None, 'error': None}
+        job = StoredJob(self.store, key, iterations, mps_configs, hub_config)
+        ahead = sum(1 for other_key, (other, _) in self.pending.items() if other == client and other_key != key)
+        sequence = next(self.sequence)
+        # queue first: a bad entry must fail before any other state changes
+        heapq.heappush(self.queue, (int(priority), ahead, sequence, key))
+        self.pending.pop(key, None)
+        self.jobs.pop(key, None)
+        self.jobs[key] = job
+        self.pending[key] = (client, sequence)
+        self.schedule()
+        return self.status(key)
+
+    def status(self, key):
+        job = self.jobs.get(key)
+        if job is None:
+            return None
+        state = job.state
+        position = None
+        if state == 'queued':
+            position = [entry[3] for entry in sorted(filter(self.queued, self.queue))].index(key)
+        return {'key': key, 'state': state, 'done': job.done, 'iterations': job.iterations, 'position': position,
+                'error': None if job.error is None else str(job.error)}
+
+    def queued(self, entry):
+        # is the queue entry the one of a job still waiting (not a cancelled or resubmitted job's)
+        key = entry[3]
+        return key in self.pending and self.pending[key][1] == entry[2] and self.jobs[key].state == 'queued'
+
+    def cancel(self, key):
+        # cancels a queued job, or a running one at its next chunk boundary
+        job = self.jobs.get(key)
+        if job is None:
+            return None
+        job.cancel()
+        self.schedule()
+        return self.status(key)
+
+    def forget(self, key):
+        # drops a job and its status (cancelling it first)
+        if key in self.jobs:
+            self.cancel(key)
+            del self.jobs[key]
+            self.pending.pop(key, None)
+
+    def schedule(self):
+        # release the jobs that ended and start queued ones while workers are free
+        running = 0
+        for key in list(self.pending):
+            state = self.jobs[key].state
+            if state == 'running':
+                running += 1
+            elif state != 'queued':
+                del self.pending[key]
+        while self.queue and running < self.workers:
+            entry = heapq.heappop(self.queue)
+            if self.queued(entry):
+                self.jobs[entry[3]].start()
+                running += 1
+        ended = [key for key in self.jobs if key not in self.pending]
+        for key in ended[:max(len(ended) - FINISHED_JOBS, 0)]:
+            del self.jobs[key]
+
+class JobHandler(tornado.web.RequestHandler):
+    def initialize(self, scheduler):
+        self.scheduler = scheduler
+
+    def reply(self, status):
+        if status is None:
+            raise tornado.web.HTTPError(404)
+        self.write(status)
+
+    def post(self, key=None, action=None):
+        if key is None:
+            try:
+                body = json.loads(self.request.body)
+                iterations = int(body['iterations'])
+                priority = int(body.get('priority', PRIORITY_INTERACTIVE))
+                if iterations < 0:
+                    raise ValueError(f"negative iterations: {iterations}")
+                if not isinstance(body['mps_configs'], list) or not isinstance(body['hub_config'], dict):
+                    raise TypeError("mps_configs must be a list and hub_config an object")
+                client = body.get('client')
+                if client is not None and not isinstance(client, str):
+                    raise TypeError("client must be a string")
+                status = self.scheduler.submit(iterations, body['mps_configs'], body['hub_config'], priority, client)
+            except (ValueError, KeyError, TypeError) as error:
+                raise tornado.web.HTTPError(400, reason=f"invalid job: {error}")
+            self.reply(status)
+        elif action == 'cancel':
+            self.reply(self.scheduler.cancel(key))
+        else:
+            raise tornado.web.HTTPError(404)
+
+    def get(self, key=None, action=None):
+        if key is None:
+            self.write({'jobs': [self.scheduler.status(key) for key in self.scheduler.jobs]})
+        else:
+            self.reply(self.scheduler.status(key))
+
+    def delete(self, key=None, action=None):
+        if key is None:
+            raise tornado.web.HTTPError(405)
+        self.scheduler.forget(key)
+        self.set_status(204)
+
+def make_app(scheduler):
+    return tornado.web.Application([
+        (r'/jobs', JobHandler, {'scheduler': scheduler}),
+        (r'/jobs/([0-9a-f]{64})', JobHandler, {'scheduler': scheduler}),
+        (r'/jobs/([0-9a-f]{64})/(cancel)', JobHandler, {'scheduler': scheduler}),
+    ])
+
+class RemoteJob:
+    # a job of the service, with the attributes of background.SimulationJob that the dashboard reads;
+    # the status is the one of the last request, the results are read from the store once it is done
+    def __init__(self, registry, status):
+        self.registry = registry
+        self.timer = PhaseTimer()
+        self.kpis = None  # accumulated in the service, not sent
+        self._results = None
+        self.update(status)
+
+    def update(self, status):
+        self.key = status['key']
+        self.state = status['state']
+        self.done = status['done']
+        self.iterations = status['iterations']
+        self.position = status['position']
+        self.error = status['error']
+
+    def refresh(self):
+        status = self.registry.request('get', f"/jobs/{self.key}")
+        if status is not None:
+            self.update(status)
+        return self
+
+    def cancel(self):
+        status = self.registry.request('post', f"/jobs/{self.key}/cancel")
+        if status is not None:
+            self.update(status)
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.running and (deadline is None or time.monotonic() < deadline):
+            time.sleep(POLL_INTERVAL if deadline is None else max(min(POLL_INTERVAL, deadline - time.monotonic()), 0))
+            self.refresh()
+
+    @property
+    def cancelled(self):
+        return self.state == 'cancelled'
+
+    @property
+    def running(self):
+        return self.state in ('queued', 'running')
+
+    @property
+    def finished(self):
+        return self.state == 'done'
+
+    @property
+    def progress(self):
+        return self.done / self.iterations if self.iterations else 1.0
+
+    def results(self):
+        # the stored results once the job is done (no partial results: they stay in the service)
+        if self.finished and self._results is None:
+            self._results = self.registry.store.load(self.key)
+        return self._results
+
+class ServiceRegistry:
+    # background.JobRegistry interface over the job service at `url`
+    def __init__(self, url=SERVICE_URL, store=None, client=None, priority=PRIORITY_INTERACTIVE):
+        self.url = url.rstrip('/')
+        self.store = store if store is not None else ResultStore()
+        self.client = client
+        self.priority = priority
+        self.session = requests.Session()
+
+    def request(self, method, path, payload=None):
+        # decoded JSON reply, None for unknown jobs
+        response = self.session.request(method, self.url + path, json=payload, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json() if response.content else None
+
+    def start(self, key, iterations, mps_configs, hub_config, **kwargs):
+        # run options of SimulationJob (sample, ...) are the service's
+        status = self.request('post', '/jobs', {'iterations': iterations, 'mps_configs': mps_configs, 'hub_config': hub_config,
+                                                'priority': self.priority, 'client': self.client})
+        if status['key'] != key:
+            raise ValueError(f"job service hashed the configuration as {status['key']}, expected {key}")
+        return RemoteJob(self, status)
+
+    def get(self, key):
+        status = self.request('get', f"/jobs/{key}")
+        return RemoteJob(self, status) if status is not None else None
+
+    def discard(self, key):
+        self.request('delete', f"/jobs/{key}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a shared simulation job queue")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="simulations running at a time")
+    parser.add_argument('--store', default=DEFAULT_STORE_URL, help="SQLAlchemy URL of the shared result store")
+    args = parser.parse_args(argv)
+
+    tornado.log.enable_pretty_logging()
+    scheduler = Scheduler(ResultStore(args.store), args.workers)
+    make_app(scheduler).listen(args.port, args.address)
+    tornado.ioloop.PeriodicCallback(scheduler.schedule, SCHEDULE_INTERVAL_MS).start()
+    print(f"job service on http://{args.address}:{args.port} ({args.workers} workers, store {args.store})", flush=True)
+    tornado.ioloop.IOLoop.current().start()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# kpis.py
+
+import numpy as np
+from mps_class import CUTOFF_THRESHOLD, TYPE_STD
+
+# Fleet KPIs reduced while the fleet steps (Fleet.track_kpis), instead of from recorded trajectories.
+# Every accumulator holds one value per unit, so the memory does not grow with the run length and a run
+# can report its KPIs with recording switched off (Fleet.run(record=False)). Per unit:
+#   min_soc / mean_soc / final_soc    SOC over the run (%)
+#   steps_below_cutoff                steps ending below CUTOFF_THRESHOLD
+#   unserved_energy                   load the battery could not supply: growth of its deficit below empty (kWh)
+#   energy_in / energy_out            power taken from / given to the hub link (kWh), as served by the links
+#   solar_energy / load_energy        solar input and local load (kWh)
+# The fleet totals sum the MPS units only; a hub's own row already aggregates them.
+
+KPI_VARIABLES = ['min_soc', 'mean_soc', 'final_soc', 'steps_below_cutoff', 'unserved_energy', 'energy_in', 'energy_out', 'solar_energy', 'load_energy']
+
+# running sums, scaled up together when the fleet fast-forwards over repeated days
+ACCUMULATORS = ['soc_sum', 'below_cutoff', 'unserved', 'energy_in', 'energy_out', 'solar_energy', 'load_energy']
+
+class FleetKPIs:
+    def __init__(self):
+        self.names = None
+        self.steps = 0
+
+    def attach(self, fleet):
+        # start from the fleet's current state (called by Fleet.track_kpis)
+        n = len(fleet.names)
+        self.names = list(fleet.names)
+        self.units = fleet.mps_type == TYPE_STD
+        self.steps = 0
+        self.min_soc = np.full(n, np.inf)
+        self.final_soc = np.copy(fleet.soc)
+        self.deficit = np.maximum(-fleet.remaining_battery, 0.0)
+        self.soc_sum = np.zeros(n)
+        self.below_cutoff = np.zeros(n, dtype=np.int64)
+        self.unserved = np.zeros(n)
+        self.energy_in = np.zeros(n)
+        self.energy_out = np.zeros(n)
+        self.solar_energy = np.zeros(n)
+        self.load_energy = np.zeros(n)
+        return self
+
+    def update(self, fleet):
+        # fold in the step the fleet has just taken
+        soc = fleet.soc
+        np.minimum(self.min_soc, soc, out=self.min_soc)
+        self.final_soc[:] = soc
+        self.soc_sum += soc
+        self.below_cutoff += soc < CUTOFF_THRESHOLD
+        deficit = np.maximum(-fleet.remaining_battery, 0.0)
+        self.unserved += np.maximum(deficit - self.deficit, 0.0)
+        self.deficit = deficit
+        hours = fleet.step_duration
+        self.energy_in += fleet.served_in * hours
+        self.energy_out += fleet.served_out * hours
+        self.solar_energy += fleet.solar_input * hours
+        self.load_energy += fleet.local_load * hours
+        self.steps += 1
+
+    def state(self):
+        return dict({name: np.copy(getattr(self, name)) for name in ACCUMULATORS}, steps=self.steps)
+
+    def repeat(self, since, times):
+        # the steps taken since state() returned `since` repeat `times` more times (Fleet fast-forward).
+        # The state at both ends of a cycle is the same, so min / final SOC and the deficit stay as they are.
+        for name in ACCUMULATORS:
+            value = getattr(self, name)
+            setattr(self, name, value + (value - since[name]) * times)
+        self.steps += (self.steps - since['steps']) * times
+
+    def unit(self, i):
+        return {
+            'min_soc': float(self.min_soc[i]),
+            'mean_soc': float(self.soc_sum[i] / self.steps) if self.steps else float('nan'),
+            'final_soc': float(self.final_soc[i]),
+            'steps_below_cutoff': int(self.below_cutoff[i]),
+            'unserved_energy': float(self.unserved[i]),
+            'energy_in': float(self.energy_in[i]),
+            'energy_out': float(self.energy_out[i]),
+            'solar_energy': float(self.solar_energy[i]),
+            'load_energy': float(self.load_energy[i]),
+        }
+
+    def totals(self):
+        # the MPS units together: SOC extremes / means over units, counts and energies summed
+        units = self.units
+        steps = max(self.steps, 1)
+        return {
+            'min_soc': float(self.min_soc[units].min()),
+            'mean_soc': float(self.soc_sum[units].sum() / (steps * units.sum())),
+            'final_soc': float(self.final_soc[units].mean()),
+            'steps_below_cutoff': int(self.below_cutoff[units].sum()),
+            'units_below_cutoff': int((self.below_cutoff[units] > 0).sum()),
+            'unserved_energy': float(self.unserved[units].sum()),
+            'energy_in': float(self.energy_in[units].sum()),
+            'energy_out': float(self.energy_out[units].sum()),
+            'solar_energy': float(self.solar_energy[units].sum()),
+            'load_energy': float(self.load_energy[units].sum()),
+        }
+
+    def summary(self):
+        # {system name: KPIs}, in fleet order, plus 'fleet' for the totals
+        summary = {name: self.unit(i) for i, name in enumerate(self.names)}
+        summary['fleet'] = self.totals()
+        return summary
@@ -1,21 +1,38 @@
 # load_output_class.py
 
+import numpy as np
+from profile_cache import load_curve
+from measured_series import SeriesReader
+
 # This class is used to store the load output for a given time
 
 class LoadOutput:
-    def __init__(self, load_kw, load_start, load_end):
+    def __init__(self, load_kw, load_start, load_end, step_hours=None, series=None):
         self.load_kw = load_kw
         self.load_start = load_start
         self.load_end = load_end
+        self.step_hours = step_hours  # None: each iteration is one hour of the day
+        self.series = series  # measured_series.MeasuredSeries used instead of the on/off block
+        self.reader = SeriesReader(series, step_hours) if series is not None else None
+
+    @classmethod
+    def from_series(cls, series, step_hours=None):
+        # metered load (kW) resampled to the simulation step
+        return cls(0, 0, 0, step_hours, series)
 
     # Get the load output for a given time
     def get_output(self, x):
-        # x is the time in hours since the start of the simulation
+        # x is the iteration since the start of the simulation (an int or an array of them)
         # need to get it in the form of 0-24 hours, to represent the time of day
-        x = x % 24
+        if self.reader is not None:
+            return self.reader[x]
+        if isinstance(x, np.ndarray):
+            Y = load_curve(self.load_kw, self.load_start, self.load_end, self.step_hours)
+            return Y[np.asarray(x) % len(Y)]
+
+        x = x % 24 if self.step_hours is None else (x * self.step_hours) % 24
 
         if x >= self.load_start and x < self.load_end:
             return self.load_kw
         else:
             return 0
-
@@ -0,0 +1,126 @@
+# measured_series.py
+
+from functools import lru_cache
+import numpy as np
+
+# Measured solar / load time series (kW) as simulation inputs.
+# Series are memory-mapped (.npy, or Arrow IPC / Feather files) and read zero-copy: only the samples of the
+# steps being simulated are touched, and every unit opening the same file shares one mapping.
+# A series is resampled to the simulation step when read: the mean of the samples inside each step when
+# samples are finer than the step (e.g. 1 or 15 minute data into half hour steps), each sample held for
+# several steps when they are coarser. The series wraps around at its end, like the day profiles.
+#
+# Config spec (the solar_series / load_series entry of an MPS config):
+#   {path = "sites.npy", sample_hours = 0.25, site = 3, scale = 1.0}
+#   path:  .npy of shape (samples,) or (sites, samples), or .arrow / .feather with one column per site
+#   site:  row of a 2-D .npy, or column name / index of an Arrow file
+#   scale: factor applied to the values (e.g. 0.001 for W -> kW)
+
+@lru_cache(maxsize=None)
+def _mapped_npy(path):
+    return np.load(path, mmap_mode='r')
+
+@lru_cache(maxsize=None)
+def _mapped_arrow(path):
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+def map_series(path, site=None):
+    # zero-copy 1-D view of one site of a mapped file
+    path = str(path)
+    if path.endswith('.npy'):
+        values = _mapped_npy(path)
+        if values.ndim == 2:
+            values = values[0 if site is None else site]
+        return values
+    table = _mapped_arrow(path)
+    column = table.column(0 if site is None else site)
+    if column.num_chunks != 1:
+        raise ValueError(f"{path}: column {site} is split over {column.num_chunks} record batches, write it as one batch to map it")
+    return column.chunk(0).to_numpy(zero_copy_only=True)
+
+class MeasuredSeries:
+    def __init__(self, values, sample_hours, scale=1.0, spec=None):
+        self.values = values
+        self.sample_hours = sample_hours
+        self.scale = scale
+        self.spec = spec  # config spec it was opened from (None for in-memory values)
+
+    @classmethod
+    def open(cls, path, sample_hours, site=None, scale=1.0):
+        spec = {'path': str(path), 'sample_hours': sample_hours, 'site': site, 'scale': scale}
+        return cls(map_series(path, site), sample_hours, scale, spec)
+
+    @property
+    def key(self):
+        # equal for series opened from equal specs (each unit's config opens its own MeasuredSeries)
+        return tuple(sorted(self.spec.items())) if self.spec is not None else id(self)
+
+    def __repr__(self):
+        return f"MeasuredSeries({self.spec!r})" if self.spec is not None else f"MeasuredSeries(<{len(self.values)} samples>, {self.sample_hours})"
+
+    def _ratio(self, step_hours):
+        # samples per step (> 1) or steps per sample (< 1), both whole numbers
+        ratio = step_hours / self.sample_hours
+        whole = round(ratio) if ratio >= 1 else 1 / round(1 / ratio)
+        if abs(ratio - whole) > 1e-9 * ratio:
+            raise ValueError(f"cannot resample {self.sample_hours} h samples to {step_hours} h steps")
+        return whole
+
+    def steps(self, step_hours):
+        # number of simulation steps covered before the series wraps
+        ratio = self._ratio(step_hours)
+        return len(self.values) // ratio if ratio >= 1 else len(self.values) * round(1 / ratio)
+
+    def block(self, start, count, step_hours):
+        # float64 values of `count` steps from step `start`
+        ratio = self._ratio(step_hours)
+        steps = self.steps(step_hours)
+        if steps == 0:
+            raise ValueError("series is shorter than one simulation step")
+        out = np.empty(count)
+        done = 0
+        while done < count:
+            first = (start + done) % steps
+            n = min(count - done, steps - first)
+            if ratio >= 1:
+                samples = np.asarray(self.values[first * ratio:(first + n) * ratio], dtype=np.float64)
+                out[done:done + n] = samples.reshape(n, ratio).mean(axis=1)
+            else:
+                repeat = round(1 / ratio)
+                samples = np.asarray(self.values[first // repeat:(first + n - 1) // repeat + 1], dtype=np.float64)
+                out[done:done + n] = np.repeat(samples, repeat)[first % repeat:first % repeat + n]
+            done += n
+        if self.scale != 1.0:
+            out *= self.scale
+        return out
+
+def series_from_config(spec):
+    # MeasuredSeries from an MPS config entry (a MeasuredSeries or an open() spec dict)
+    if spec is None or isinstance(spec, MeasuredSeries):
+        return spec
+    return MeasuredSeries.open(**spec)
+
+def series_step_hours(step_hours):
+    # step_hours=None keeps the hourly-indexed day profiles, so series are read one hour per iteration too
+    return 1.0 if step_hours is None else step_hours
+
+# Reads a series in blocks of steps for step-by-step consumers (SolarInput / LoadOutput)
+class SeriesReader:
+    BLOCK = 48 * 7
+
+    def __init__(self, series, step_hours):
+        self.series = series
+        self.step_hours = series_step_hours(step_hours)
+        self.start = None
+        self.values = None
+
+    def __getitem__(self, x):
+        if isinstance(x, np.ndarray):
+            return self.series.block(0, int(x.max()) + 1, self.step_hours)[x] if len(x) else np.empty(0)
+        if self.start is None or not self.start <= x < self.start + self.BLOCK:
+            self.start = x - x % self.BLOCK
+            self.values = self.series.block(self.start, self.BLOCK, self.step_hours)
+        return self.values[x - self.start]
@@ -1,8 +1,11 @@
 # mps_class.py
 
 import time
+import numpy as np
 from solar_input_class import SolarInput
 from load_output_class import LoadOutput
+from measured_series import series_from_config
+from results_recorder_class import ResultsRecorder, RESULT_VARIABLES
 
 # MPS class is used to model the behavior of a mobile power system (MPS) in the simulation.
 
@@ -20,8 +23,12 @@ POWER_OUT_MIN_TIME = 6  # minimum time to allow power out
 POWER_IN_MIN_TIME = 6  # minimum time to allow power in
 GRAPH_SCALE = 10  # scale factor for graphing
 
+def step_duration(step_hours=None):
+    # hours integrated per step: the step size, or INTERVAL_DURATION for the hourly-indexed default profiles
+    return INTERVAL_DURATION if step_hours is None else step_hours
+
 class MPS:
-    def __init__(self, max_power, max_battery, max_solar, peak_sun_hours, init_soc, load_power, load_hours, mps_type, name):
+    def __init__(self, max_power, max_battery, max_solar, peak_sun_hours, init_soc, load_power, load_hours, mps_type, name, iterations=0, variables=RESULT_VARIABLES, dtype=np.float64, step_hours=None, solar_series=None, load_series=None):
         self.max_power = max_power # max power in kw
         self.max_battery = max_battery # battery max of the MPS (kwh)
         self.soc = init_soc # battery state of charge (0-100)
@@ -33,15 +40,16 @@ class MPS:
         self.power_out = 0    # external power out (kw)
         self.power_out_allowed = 0  # flag to allow power out
         self.power_in_allowed = 0       # flag to allow power in
-        self.solar_array = SolarInput(max_solar, peak_sun_hours)  # max kw, peak sun hours
+        self.solar_array = SolarInput(max_solar, peak_sun_hours, step_hours, series_from_config(solar_series))  # max kw, peak sun hours, profile step, measured series
         self.solar_input = 0
-        self.load_power = LoadOutput(load_power, LOAD_START, LOAD_START + load_hours)  # kw, start time, end time
+        self.load_power = LoadOutput(load_power, LOAD_START, LOAD_START + load_hours, step_hours, series_from_config(load_series))  # kw, start time, end time, profile step, measured series
         self.load_hours = load_hours
         self.mps_type = mps_type #1 if hub, 0 if not hub
         self.name = name
         self.power_out_timer = 0 #initialize timer to 0
         self.power_in_timer = 0 #initialize timer to 0
-        self.results = {}
+        self.results = ResultsRecorder(name, iterations, variables, dtype)  # preallocated result columns
+        self.step_duration = step_duration(step_hours)  # hours per iteration
 
         if self.mps_type == TYPE_HUB:
             self.power_in_threshold = HUB_POWER_IN_THRESHOLD
@@ -50,10 +58,6 @@ class MPS:
             self.power_in_threshold = POWER_IN_THRESHOLD
             self.power_out_threshold = POWER_OUT_THRESHOLD
 
-        for var in ["name", "soc", "remaining_battery", "bat_charge", "bat_discharge", "solar_input", "local_load", "power_in", "power_out", "power_in_allowed", "power_out_allowed"]:
-            #create a results array for each variable
-            self.results[var] = []
-
     def power_out(self, new_value=None):
         if new_value is not None:
             if self.mps_type == TYPE_HUB:
@@ -111,14 +115,13 @@ class MPS:
             self.bat_discharge = self.bat_discharge + self.power_out
 
         # update remaining capacity and soc
-        self.remaining_battery = self.remaining_battery + (self.bat_charge - self.bat_discharge) * INTERVAL_DURATION
+        self.remaining_battery = self.remaining_battery + (self.bat_charge - self.bat_discharge) * self.step_duration
         if(self.remaining_battery > self.max_battery):
             self.remaining_battery = self.max_battery
         self.soc = (self.remaining_battery / self.max_battery) * 100
 
-        # Add to the results array
-        for var in ["name", "soc", "remaining_battery", "bat_charge", "bat_discharge", "solar_input", "local_load", "power_in", "power_out", "power_in_allowed", "power_out_allowed"]:
-            self.results[var].append(getattr(self, var))
+        # Add to the results columns
+        self.results.record(self)
 
     def get_results(self):
         return self.results
@@ -0,0 +1,75 @@
+# plotting.py
+
+import numpy as np
+import plotly.graph_objects as go
+
+# Downsampled line traces for the dashboard.
+# Series longer than the point budget are reduced with a shape preserving method before they are sent
+# to the browser, and traces switch to WebGL (Scattergl) above WEBGL_THRESHOLD points.
+
+POINT_BUDGET = 2000  # max points per trace
+WEBGL_THRESHOLD = 5000  # points (before downsampling) above which traces are drawn with WebGL
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and, per bucket, the point forming
+    # the largest triangle with the previously kept point and the average of the next bucket.
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    selected = np.empty(n_out, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+def minmax(x, y, n_out):
+    # min and max of every bucket (in time order), so spikes always survive
+    y = np.asarray(y)
+    n = len(y)
+    buckets = max(n_out // 2, 1)
+    if n_out >= n or n < 2 * buckets:
+        return np.arange(n)
+
+    size = n // buckets
+    blocks = y[:size * buckets].reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    low = offsets + blocks.argmin(axis=1)
+    high = offsets + blocks.argmax(axis=1)
+    return np.unique(np.concatenate([[0, n - 1], low, high]))
+
+DOWNSAMPLERS = {'lttb': lttb, 'minmax': minmax}
+
+def downsample(x, y, budget=POINT_BUDGET, method='lttb'):
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= budget:
+        return x, y
+    selected = DOWNSAMPLERS[method](x, y, budget)
+    return x[selected], y[selected]
+
+def window(x, y, x_range=None):
+    # full resolution points inside x_range (inclusive); x must be sorted
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x_range is None:
+        return x, y
+    start, end = np.searchsorted(x, x_range[0], side='left'), np.searchsorted(x, x_range[1], side='right')
+    return x[start:end], y[start:end]
+
+def line_trace(x, y, name, x_range=None, budget=POINT_BUDGET, method='lttb', webgl_threshold=WEBGL_THRESHOLD):
+    # the zoom window is cut from the full resolution data first, then reduced to the point budget
+    x, y = window(x, y, x_range)
+    trace_type = go.Scattergl if len(x) > webgl_threshold else go.Scatter
+    x, y = downsample(x, y, budget, method)
+    return trace_type(x=x, y=y, mode='lines', name=name)
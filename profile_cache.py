@@ -0,0 +1,76 @@
+# profile_cache.py
+
+from functools import lru_cache
+import numpy as np
+
+# Shared solar and load day profiles.
+# Each (max_kw, peak_sun_hours, step_hours) solar curve and (load_kw, start, end, step_hours) load curve is
+# built once and shared (read-only) by every unit that uses it.
+# step_hours=None keeps the original profiles: 24 samples per day, one per iteration (SolarInput over
+# linspace(0, 24, 24), LoadOutput on iteration % 24). A step size in hours samples the day at the
+# simulation's real resolution instead, e.g. INTERVAL_DURATION gives 48 samples per day.
+
+SOLAR_MEAN = 12  # Noon
+SOLAR_STD_DEV = 3  # Standard deviation
+
+def norm_pdf(x, mean, std_dev):
+    # scipy.stats.norm.pdf (same operations, same values) without importing scipy.stats at startup
+    x = (x - mean) / std_dev
+    return np.exp(-x**2/2.0) / np.sqrt(2*np.pi) / std_dev
+
+def steps_per_day(step_hours=None):
+    if step_hours is None:
+        return 24
+    return int(round(24 / step_hours))
+
+def profile_hours(step_hours=None):
+    # time of day (hours) of every sample of a day profile
+    if step_hours is None:
+        return np.arange(24)
+    return np.arange(steps_per_day(step_hours)) * step_hours
+
+@lru_cache(maxsize=None)
+def solar_curve(max_kw, peak_sun_hours, step_hours=None):
+    if step_hours is None:
+        X = np.linspace(0, 24, 24)  # 0 to 24 hours
+    else:
+        X = profile_hours(step_hours)
+    Y = max_kw * peak_sun_hours * norm_pdf(X, SOLAR_MEAN, SOLAR_STD_DEV)
+    Y.setflags(write=False)
+    return Y
+
+@lru_cache(maxsize=None)
+def load_curve(load_kw, load_start, load_end, step_hours=None):
+    X = profile_hours(step_hours)
+    Y = np.where((X >= load_start) & (X < load_end), float(load_kw), 0.0)
+    Y.setflags(write=False)
+    return Y
+
+def _table(curve, keys, step_hours):
+    # one row per unit, computed once per distinct key
+    rows = {}
+    index = np.empty(len(keys), dtype=np.intp)
+    for i, key in enumerate(keys):
+        index[i] = rows.setdefault(key, len(rows))
+    curves = np.empty((len(rows), steps_per_day(step_hours)))
+    for key, row in rows.items():
+        curves[row] = curve(*key, step_hours)
+    return curves[index]
+
+def solar_table(max_kw, peak_sun_hours, step_hours=None):
+    # (units, steps per day) solar curves for a batch of units
+    return _table(solar_curve, list(zip(max_kw, peak_sun_hours)), step_hours)
+
+def load_table(load_kw, load_start, load_end, step_hours=None):
+    # (units, steps per day) load curves for a batch of units
+    return _table(load_curve, list(zip(load_kw, load_start, load_end)), step_hours)
+
+def horizon(table, iterations, start=0):
+    # whole-horizon (units, iterations) array from a day table, wrapping at the end of each day
+    return table[:, (start + np.arange(iterations)) % table.shape[1]]
+
+def solar_profiles(max_kw, peak_sun_hours, iterations, step_hours=None, start=0):
+    return horizon(solar_table(max_kw, peak_sun_hours, step_hours), iterations, start)
+
+def load_profiles(load_kw, load_start, load_end, iterations, step_hours=None, start=0):
+    return horizon(load_table(load_kw, load_start, load_end, step_hours), iterations, start)
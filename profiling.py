@@ -0,0 +1,107 @@
+# profiling.py
+
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Lightweight instrumentation for the simulation and the dashboard.
+# PhaseTimer accumulates wall time per named phase plus event counters (e.g. unit steps);
+# SamplingProfiler samples the stack of one thread from a background thread to see where time goes
+# inside a phase without tracing every call.
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}  # name -> [calls, seconds]
+        self.counters = Counter()
+        self.profile = None  # SamplingProfiler.report() when a sampling run was attached
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds, calls=1):
+        entry = self.phases.setdefault(name, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def merge(self, other):
+        for name, (calls, seconds) in other.phases.items():
+            self.add(name, seconds, calls)
+        self.counters.update(other.counters)
+        self.profile = other.profile or self.profile
+
+    def report(self):
+        return [{'phase': name, 'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.phases.items()]
+
+    def to_dict(self):
+        return {'phases': self.report(), 'counters': dict(self.counters), 'profile': self.profile}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+# phase of an optional timer (no-op when timer is None)
+def phase(timer, name):
+    return timer.phase(name) if timer is not None else nullcontext()
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.self_samples = Counter()  # innermost frame (function where time is spent)
+        self.total_samples = Counter()  # every function on the stack
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_samples[self._label(frame)] += 1
+            seen = set()
+            while frame is not None:
+                label = self._label(frame)
+                if label not in seen:
+                    seen.add(label)
+                    self.total_samples[label] += 1
+                frame = frame.f_back
+
+    @staticmethod
+    def _label(frame):
+        code = frame.f_code
+        return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def report(self, limit=25):
+        return {
+            'interval': self.interval,
+            'samples': self.samples,
+            'self': [{'function': label, 'samples': n} for label, n in self.self_samples.most_common(limit)],
+            'total': [{'function': label, 'samples': n} for label, n in self.total_samples.most_common(limit)],
+        }
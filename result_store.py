@@ -0,0 +1,140 @@
+# result_store.py
+
+import json
+import os
+import time
+import numpy as np
+from sqlalchemy import (
+    create_engine, MetaData, Table, Column, Integer, Float, String, Text, LargeBinary, ForeignKey, Index,
+    select, insert, delete, func,
+)
+from sqlalchemy.exc import IntegrityError
+from results_recorder_class import allocate_results
+
+# Local store of simulation results (SQLite by default, any SQLAlchemy URL works).
+# runs holds one row per simulated configuration (config_hash, see simulation.config_hash); trajectories
+# holds the per-system results in columnar batches: one row per system, variable and batch of iterations,
+# with the values as a float64 blob plus their min / max / sum. A run is written with one executemany and
+# loads by config hash with one indexed query and np.frombuffer per batch, no per-iteration rows; systems
+# are indexed by name too. Cross-run questions (minimum SOC per configuration, ...) are plain SQL over the
+# batch statistics, so they run in the database without reading the values.
+
+DEFAULT_STORE_URL = os.environ.get('MPS_RESULT_STORE', 'sqlite:///mps_results.db')
+BATCH_ITERATIONS = 48 * 28  # iterations per stored batch
+
+metadata = MetaData()
+
+runs = Table(
+    'runs', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('config_hash', String(64), nullable=False, unique=True, index=True),
+    Column('created', Float, nullable=False),
+    Column('iterations', Integer, nullable=False),
+    Column('systems', Text, nullable=False),  # JSON list, in results order
+    Column('variables', Text, nullable=False),  # JSON list of the recorded variables
+    Column('config', Text, nullable=False),  # JSON of the configuration and run options
+)
+
+trajectories = Table(
+    'trajectories', metadata,
+    Column('run_id', Integer, ForeignKey('runs.id', ondelete='CASCADE'), nullable=False),
+    Column('system', String(128), nullable=False),
+    Column('variable', String(32), nullable=False),
+    Column('start', Integer, nullable=False),  # first iteration of the batch
+    Column('length', Integer, nullable=False),
+    Column('minimum', Float, nullable=False),
+    Column('maximum', Float, nullable=False),
+    Column('total', Float, nullable=False),
+    Column('data', LargeBinary, nullable=False),  # float64 values
+    Index('ix_trajectories_run_system', 'run_id', 'system', 'variable', 'start'),
+    Index('ix_trajectories_system', 'system'),
+)
+
+class ResultStore:
+    def __init__(self, url=DEFAULT_STORE_URL):
+        self.engine = create_engine(url)
+        metadata.create_all(self.engine)
+
+    def has(self, key):
+        with self.engine.connect() as conn:
+            return conn.execute(select(runs.c.id).where(runs.c.config_hash == key)).first() is not None
+
+    def save(self, key, results, config=None):
+        # results: run_simulation output; a configuration already in the store is kept as it is
+        names = list(results)
+        variables = list(results[names[0]].variables)
+        iterations = results[names[0]].length
+        try:
+            return self._save(key, names, variables, iterations, results, config)
+        except IntegrityError:
+            return False  # saved by another process (e.g. the job service) meanwhile
+
+    def _save(self, key, names, variables, iterations, results, config):
+        with self.engine.begin() as conn:
+            if conn.execute(select(runs.c.id).where(runs.c.config_hash == key)).first() is not None:
+                return False
+            run_id = conn.execute(insert(runs).values(
+                config_hash=key, created=time.time(), iterations=iterations, systems=json.dumps(names),
+                variables=json.dumps(variables), config=json.dumps(config or {}, default=str),
+            )).inserted_primary_key[0]
+            rows = []
+            for name in names:
+                data = results[name]
+                for var in variables:
+                    values = np.asarray(data[var], dtype=np.float64)
+                    for start in range(0, len(values), BATCH_ITERATIONS):
+                        batch = values[start:start + BATCH_ITERATIONS]
+                        rows.append({'run_id': run_id, 'system': name, 'variable': var, 'start': start, 'length': len(batch),
+                                     'minimum': float(batch.min()), 'maximum': float(batch.max()), 'total': float(batch.sum()),
+                                     'data': batch.tobytes()})
+            if rows:
+                conn.execute(insert(trajectories), rows)
+        return True
+
+    def load(self, key):
+        # run_simulation-like results of a stored configuration, None if it is not stored
+        with self.engine.connect() as conn:
+            run = conn.execute(select(runs).where(runs.c.config_hash == key)).first()
+            if run is None:
+                return None
+            names = json.loads(run.systems)
+            variables = json.loads(run.variables)
+            batches = conn.execute(
+                select(trajectories.c.system, trajectories.c.variable, trajectories.c.start, trajectories.c.data)
+                .where(trajectories.c.run_id == run.id)
+            ).all()
+        buffer, recorders = allocate_results(names, run.iterations, variables)
+        rows = {var: i for i, var in enumerate(variables)}
+        index = {name: i for i, name in enumerate(names)}
+        for system, var, start, data in batches:
+            values = np.frombuffer(data, dtype=np.float64)
+            buffer[rows[var], index[system], start:start + len(values)] = values
+        for recorder in recorders:
+            recorder.length = run.iterations
+        return dict(zip(names, recorders))
+
+    def delete(self, key):
+        with self.engine.begin() as conn:
+            run_id = conn.execute(select(runs.c.id).where(runs.c.config_hash == key)).scalar()
+            if run_id is None:
+                return False
+            conn.execute(delete(trajectories).where(trajectories.c.run_id == run_id))
+            conn.execute(delete(runs).where(runs.c.id == run_id))
+        return True
+
+    def list_runs(self):
+        # metadata of every stored run, newest first
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(runs.c.config_hash, runs.c.created, runs.c.iterations, runs.c.systems).order_by(runs.c.created.desc())).all()
+        return [{'config_hash': row.config_hash, 'created': row.created, 'iterations': row.iterations, 'systems': json.loads(row.systems)} for row in rows]
+
+    def min_soc_per_config(self, system=None):
+        # {config_hash: minimum SOC over all systems (or the given one)}, computed in the database
+        query = (select(runs.c.config_hash, func.min(trajectories.c.minimum))
+                 .join(trajectories, trajectories.c.run_id == runs.c.id)
+                 .where(trajectories.c.variable == 'soc')
+                 .group_by(runs.c.config_hash))
+        if system is not None:
+            query = query.where(trajectories.c.system == system)
+        with self.engine.connect() as conn:
+            return dict(conn.execute(query).all())
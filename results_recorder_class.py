@@ -0,0 +1,65 @@
+# results_recorder_class.py
+
+from collections.abc import Mapping
+from operator import attrgetter
+import numpy as np
+
+# ResultsRecorder stores the per-iteration results of one system in preallocated numpy columns.
+# It behaves like a read-only dict of variable -> column, so results[name]['soc'] keeps working,
+# and exposes the columns without copying as a pandas DataFrame or an Arrow table.
+
+RESULT_VARIABLES = ["soc", "remaining_battery", "bat_charge", "bat_discharge", "solar_input", "local_load", "power_in", "power_out", "power_in_allowed", "power_out_allowed"]
+
+class ResultsRecorder(Mapping):
+    def __init__(self, name, iterations=0, variables=RESULT_VARIABLES, dtype=np.float64, buffer=None):
+        self.name = name
+        self.variables = list(variables)
+        self.index = {var: i for i, var in enumerate(self.variables)}
+        # one row per variable, one column per iteration
+        if buffer is None:
+            buffer = np.empty((len(self.variables), iterations), dtype=dtype)
+        self.data = buffer
+        self.length = 0
+        getter = attrgetter(*self.variables)
+        self._getter = getter if len(self.variables) > 1 else (lambda obj: (getter(obj),))
+
+    def record(self, obj):
+        # append the current values of the recorded attributes of obj
+        if self.length == self.data.shape[1]:
+            self._grow()
+        self.data[:, self.length] = self._getter(obj)
+        self.length += 1
+
+    def _grow(self):
+        # used when the number of iterations was not known up front
+        data = np.empty((self.data.shape[0], max(2 * self.data.shape[1], 64)), dtype=self.data.dtype)
+        data[:, :self.length] = self.data[:, :self.length]
+        self.data = data
+
+    def __getitem__(self, var):
+        return self.data[self.index[var], :self.length]
+
+    def __iter__(self):
+        return iter(self.variables)
+
+    def __len__(self):
+        return len(self.variables)
+
+    def to_dataframe(self):
+        # the transposed buffer is exactly pandas' block layout, so no data is copied
+        import pandas as pd
+        return pd.DataFrame(self.data[:, :self.length].T, columns=self.variables, copy=False)
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table({var: self[var] for var in self.variables})
+
+    @property
+    def nbytes(self):
+        return self.data[:, :self.length].nbytes
+
+def allocate_results(names, iterations, variables=RESULT_VARIABLES, dtype=np.float64):
+    # one shared (variable, system, iteration) buffer for a whole fleet, with a recorder view per system
+    buffer = np.empty((len(variables), len(names), iterations), dtype=dtype)
+    recorders = [ResultsRecorder(name, variables=variables, buffer=buffer[:, i, :]) for i, name in enumerate(names)]
+    return buffer, recorders
@@ -0,0 +1,62 @@
+# results_table.py
+
+import io
+import zipfile
+import numpy as np
+import pandas as pd
+
+# ResultsTable holds the results of every system of a run in one long-format DataFrame
+# (system, iteration, metric, value), built once from the recorders returned by run_simulation.
+# Rows are ordered by system, then metric, then iteration, so any (system, metric) series is a
+# contiguous slice of the value column and plots/aggregates read it without building new frames.
+
+EXPORT_FORMATS = {
+    'parquet': ('results.parquet', 'application/octet-stream'),
+    'csv.zip': ('results.zip', 'application/zip'),
+}
+
+class ResultsTable:
+    def __init__(self, results):
+        self.systems = list(results)
+        first = results[self.systems[0]]
+        self.metrics = list(first.variables)
+        self.iterations = first.length
+        self.values = np.concatenate([np.ravel(results[name].data[:, :self.iterations]) for name in self.systems])
+        # (system, metric, iteration) view of the value column
+        self.cube = self.values.reshape(len(self.systems), len(self.metrics), self.iterations)
+
+        self.frame = pd.DataFrame({
+            'system': pd.Categorical.from_codes(np.repeat(np.arange(len(self.systems)), len(self.metrics) * self.iterations), self.systems),
+            'iteration': np.tile(np.arange(self.iterations, dtype=np.int32), len(self.systems) * len(self.metrics)),
+            'metric': pd.Categorical.from_codes(np.tile(np.repeat(np.arange(len(self.metrics)), self.iterations), len(self.systems)), self.metrics),
+            'value': self.values,
+        }, copy=False)
+
+    @property
+    def nbytes(self):
+        return int(self.frame.memory_usage(index=False, deep=False).sum())
+
+    def series(self, system, metric):
+        return self.cube[self.systems.index(system), self.metrics.index(metric)]
+
+    def total(self, metric, systems=None):
+        # per-iteration sum over the given systems (all by default)
+        rows = [self.systems.index(system) for system in systems] if systems is not None else slice(None)
+        return self.cube[rows, self.metrics.index(metric)].sum(axis=0)
+
+    def system_frame(self, system):
+        # wide per-system view (one column per metric) of the long table
+        return pd.DataFrame(self.cube[self.systems.index(system)].T, columns=self.metrics, copy=False)
+
+    def export(self, fmt='parquet'):
+        # one compressed bundle for every system: the long table as Parquet, or one CSV per system in a zip
+        buffer = io.BytesIO()
+        if fmt == 'parquet':
+            self.frame.to_parquet(buffer, index=False, compression='zstd')
+        elif fmt == 'csv.zip':
+            with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+                for system in self.systems:
+                    bundle.writestr(f"{system}_results.csv", self.system_frame(system).to_csv(index=False))
+        else:
+            raise ValueError(f"unknown export format: {fmt}")
+        return buffer.getvalue()
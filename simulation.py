@@ -0,0 +1,162 @@
+# simulation.py
+
+import hashlib
+import json
+import numpy as np
+from mps_class import MPS, TYPE_STD, TYPE_HUB
+from fleet_class import Fleet
+from event_engine import EventFleet
+from results_recorder_class import RESULT_VARIABLES
+from profiling import phase
+
+def _canonical(value):
+    # numbers compare equal whatever their python/numpy type (e.g. 4 and 4.0 from a number_input)
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return value
+
+# Stable hash of a simulation configuration, used as cache / store key
+def config_hash(iterations, mps_configs, hub_config, **options):
+    payload = {'iterations': iterations, 'mps_configs': list(mps_configs), 'hub_config': hub_config, 'options': options}
+    text = json.dumps(_canonical(payload), sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+DEFAULT_CHUNK_SIZE = 48 * 7  # one week of half hour steps
+
+# Initialize the MPS objects of the reference (engine="mps") simulation
+def _create_systems(iterations, mps_configs, hub_config, variables, dtype, step_hours):
+    # Initialize multiple MPS systems based on user configurations.
+    mps_systems = []
+    for config in mps_configs:
+        mps = MPS(
+            max_power=config['max_power'],
+            max_battery=config['max_battery'],
+            max_solar=config['max_solar'],
+            peak_sun_hours=config['peak_sun_hours'],
+            init_soc=config['init_soc'],
+            load_power=config['load_power'],
+            load_hours=config['load_hours'],
+            mps_type=TYPE_STD,
+            name=config['name'],
+            iterations=iterations,
+            variables=variables,
+            dtype=dtype,
+            step_hours=step_hours,
+            solar_series=config.get('solar_series'),
+            load_series=config.get('load_series')
+        )
+        mps_systems.append(mps)
+
+    # Initialize a central hub.
+    hub = MPS(
+        max_power=hub_config['max_power'],
+        max_battery=hub_config['max_battery'],
+        max_solar=hub_config['max_solar'],
+        peak_sun_hours=hub_config['peak_sun_hours'],
+        init_soc=hub_config['init_soc'],
+        load_power=hub_config['load_power'],
+        load_hours=hub_config['load_hours'],
+        mps_type=TYPE_HUB,
+        name=hub_config['name'],
+        iterations=iterations,
+        variables=variables,
+        dtype=dtype,
+        step_hours=step_hours,
+        solar_series=hub_config.get('solar_series'),
+        load_series=hub_config.get('load_series')
+    )
+
+    return mps_systems, hub
+
+# Simulation Function
+# engine="fleet" steps all systems at once with the vectorized Fleet, engine="mps" steps one MPS object at a time.
+# Results are a ResultsRecorder per system holding the chosen variables as dtype columns.
+# step_hours=None keeps the original hourly-indexed solar/load profiles, a step size (e.g. INTERVAL_DURATION)
+# samples them at the real simulation resolution. The battery integrates step_hours per iteration
+# (INTERVAL_DURATION with None), so a day of input is the same energy at any step size.
+# timer (profiling.PhaseTimer) collects construction / step loop / hub aggregation timings and step counters.
+# An MPS or hub config with a solar_series / load_series entry reads that measured series (see measured_series)
+# instead of the synthetic profile.
+# fast_forward (fleet engine) replays the daily cycle once the fleet has settled into one (see Fleet.run).
+# engine="event" jumps every unit from one flag / timer / clipping event to the next (see EventFleet); it is only
+# faster than engine="fleet" for small fleets of mostly quiet units.
+# checkpoint (Fleet.snapshot() bytes, fleet engine) resumes that run up to `iterations` instead of starting over:
+# the results recorded before the snapshot are kept and only the remaining iterations are stepped. Passing
+# other mps_configs / hub_config than the snapshot's branches the run from there (step_hours is the snapshot's).
+# kpis (kpis.FleetKPIs, fleet engine) accumulates the fleet KPIs of the stepped iterations; with record=False no
+# trajectories are kept at all and None is returned, for runs that only need their KPIs.
+# dispatcher (fleet engine, e.g. dispatch.LPDispatcher) decides the MPS <-> hub transfers instead of the greedy
+# MPS.update rules.
+def run_simulation(iterations, mps_configs, hub_config, engine="fleet", variables=RESULT_VARIABLES, dtype=np.float64, step_hours=None, timer=None, fast_forward=False, checkpoint=None, kpis=None, record=True, dispatcher=None):
+    if checkpoint is not None and engine != "fleet":
+        raise ValueError("checkpoints need engine=\"fleet\"")
+    if (kpis is not None or not record or dispatcher is not None) and engine != "fleet":
+        raise ValueError("kpis, record=False and dispatcher need engine=\"fleet\"")
+    if engine == "fleet":
+        with phase(timer, 'construction'):
+            if checkpoint is not None:
+                fleet = Fleet.restore(checkpoint, mps_configs, hub_config, timer=timer)
+            else:
+                fleet = Fleet(mps_configs, hub_config, step_hours, timer=timer)
+            if kpis is not None:
+                fleet.track_kpis(kpis)
+            fleet.dispatcher = dispatcher
+        with phase(timer, 'step loop'):
+            fleet.run(iterations - fleet.iteration, record, variables, dtype, fast_forward)
+        return fleet.get_results() if record else None
+    if engine == "event":
+        with phase(timer, 'construction'):
+            fleet = EventFleet(mps_configs, hub_config, step_hours)
+        with phase(timer, 'step loop'):
+            fleet.run(iterations, variables=variables, dtype=dtype)
+        if timer is not None:
+            timer.count('rounds', fleet.rounds)
+            timer.count('event_steps', fleet.events)
+            timer.count('unit_steps', iterations * (len(fleet.names) + 1))
+        return fleet.get_results()
+    if engine != "mps":
+        raise ValueError(f"unknown simulation engine: {engine}")
+
+    with phase(timer, 'construction'):
+        mps_systems, hub = _create_systems(iterations, mps_configs, hub_config, variables, dtype, step_hours)
+
+    # Run simulation for the specified number of iterations, updating each MPS and the hub.
+    with phase(timer, 'step loop'):
+        for iteration in range(iterations):
+            for mps in mps_systems:
+                mps.update(iteration)
+            hub.update(iteration)
+
+            # Link MPS outputs to hub inputs
+            with phase(timer, 'hub aggregation'):
+                hub.power_in = sum(mps.power_out for mps in mps_systems)
+                hub.power_out = sum(mps.power_in for mps in mps_systems)
+    if timer is not None:
+        timer.count('steps', iterations)
+        timer.count('unit_steps', iterations * (len(mps_systems) + 1))
+
+    # Collect results for each system
+    results = {'hub': hub.get_results()}
+    for mps in mps_systems:
+        results[mps.name] = mps.get_results()
+
+    return results
+
+# Chunked simulation: yields (first iteration, results) for consecutive chunks of at most chunk_size iterations.
+# The MPS/hub state carries over between chunks and only one chunk of results is held at a time.
+def iter_simulation(iterations, mps_configs, hub_config, chunk_size=DEFAULT_CHUNK_SIZE, variables=RESULT_VARIABLES, dtype=np.float64, step_hours=None, timer=None, kpis=None):
+    with phase(timer, 'construction'):
+        fleet = Fleet(mps_configs, hub_config, step_hours, timer=timer)
+        if kpis is not None:
+            fleet.track_kpis(kpis)
+    while fleet.iteration < iterations:
+        start = fleet.iteration
+        with phase(timer, 'step loop'):
+            fleet.run(min(chunk_size, iterations - start), variables=variables, dtype=dtype)
+        yield start, fleet.get_results()
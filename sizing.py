@@ -0,0 +1,168 @@
+# sizing.py
+
+import numpy as np
+from mps_class import CUTOFF_THRESHOLD
+from fleet_class import Fleet, STATE_VARIABLES
+from profiling import phase
+
+# Sizing search: the smallest max_battery / max_solar per MPS, and hub size, that keep every unit at or above
+# CUTOFF_THRESHOLD for the whole horizon.
+#
+# With the greedy dispatch an MPS never sees the hub (its power in / out follow its own SOC and timers only),
+# so every MPS is sized on its own, and the hub afterwards against the aggregate power of the sized units:
+#   size_units  searches one parameter of every MPS at once. Each round tries `candidates` values inside every
+#               unit's open interval, all of them side by side as the rows of one fleet, and narrows the interval
+#               to the smallest passing value (the search assumes more capacity never hurts).
+#   size_hub    simulates the MPS fleet once, keeps the power it exchanges with the hub per step, and searches
+#               the hub parameter the same way with hub candidates fed that aggregate, so every hub candidate
+#               shares one simulation of the units instead of repeating it.
+# A candidate stops being stepped the moment its SOC drops below the cutoff (its row is dropped from the fleet
+# once enough rows have failed), so failing candidates cost only the steps up to their breach.
+# Every returned size was simulated and passed; if a parameter is not monotone (the hub's threshold latching
+# can make a larger battery dip below the cutoff where a smaller one did not), it is a passing size, not
+# necessarily the smallest.
+# Battery searches start at MIN_BATTERY rather than at zero: a unit without a battery has no SOC (0 / 0).
+#
+#   mps_configs, hub_config, stats = size_fleet(336, mps_configs, hub_config)
+
+SINK_HUB = {'name': 'sink', 'max_power': 0.0, 'max_battery': 1.0, 'max_solar': 0.0, 'peak_sun_hours': 0,
+            'init_soc': 50.0, 'load_power': 0.0, 'load_hours': 0}  # takes the candidates' transfers, not checked
+COMPACT_FRACTION = 0.5  # rebuild the candidate fleet without failed rows once at most this fraction survives
+MIN_BATTERY = 0.1  # kWh, smallest max_battery candidate
+
+class CandidateFleet(Fleet):
+    # candidate configurations stepped side by side; with `aggregate` ((hub power in, hub power out) per
+    # iteration of a simulated fleet) the candidates are hubs fed that aggregate, otherwise MPS units
+    def __init__(self, configs, step_hours=None, aggregate=None):
+        if aggregate is None:
+            super().__init__(configs, SINK_HUB, step_hours)
+            self.candidates = np.arange(len(configs))
+        else:
+            super().__init__([], configs, step_hours)
+            self.candidates = self.hubs
+        self.aggregate = aggregate
+
+    def _link(self):
+        if self.aggregate is not None:
+            self.power_in[self.hubs] = self.aggregate[0][self.iteration]
+            self.power_out[self.hubs] = self.aggregate[1][self.iteration]
+
+    def subset(self, rows):
+        # the same run with only the given candidate rows, continuing from the current state
+        fleet = CandidateFleet([self.configs[i] for i in rows], self.step_hours, self.aggregate)
+        source = np.concatenate([rows, [self.hub]]) if self.aggregate is None else rows
+        for var in STATE_VARIABLES:
+            getattr(fleet, var)[:] = getattr(self, var)[source]
+        fleet.iteration = self.iteration
+        return fleet
+
+def first_breach(fleet, iterations, timer=None):
+    # steps the candidate fleet to `iterations`; returns, per candidate, the iteration after which its SOC
+    # first fell below CUTOFF_THRESHOLD (iterations if it never did) and the unit-steps simulated
+    breach = np.full(len(fleet.candidates), iterations)
+    alive = np.arange(len(fleet.candidates))  # candidate index of each row of the current fleet
+    unit_steps = 0
+    with phase(timer, 'candidate steps'):
+        while fleet.iteration < iterations and len(alive):
+            fleet.step()
+            unit_steps += len(fleet.names)
+            failed = ~(fleet.soc[fleet.candidates] >= CUTOFF_THRESHOLD)  # NaN (no battery at all) fails too
+            if failed.any():
+                breach[alive[failed & (breach[alive] == iterations)]] = fleet.iteration - 1
+                if (breach[alive] == iterations).sum() <= COMPACT_FRACTION * len(alive):
+                    keep = np.flatnonzero(breach[alive] == iterations)
+                    alive = alive[keep]
+                    if len(alive):
+                        fleet = fleet.subset(keep)
+    return breach, unit_steps
+
+def _lower_bound(parameter, low):
+    # `low` raised to MIN_BATTERY for battery capacities, which must stay positive
+    return np.maximum(low, MIN_BATTERY) if parameter == 'max_battery' else low
+
+def _search(make_fleet, names, low, high, tolerance, iterations, candidates, timer):
+    # per name, the smallest passing value in [low, high] to within `tolerance` (None if `high` fails);
+    # make_fleet(list of (name index, value)) builds the candidate fleet of one round
+    low = np.broadcast_to(np.asarray(low, dtype=np.float64), (len(names),)).copy()
+    high = np.broadcast_to(np.asarray(high, dtype=np.float64), (len(names),)).copy()
+    best = np.full(len(names), np.nan)  # smallest value seen passing
+    stats = {'rounds': 0, 'candidates': 0, 'unit_steps': 0}
+
+    # first round: the upper bounds (feasible at all?) and the lower bounds (nothing to search?)
+    trials = [(i, value) for i in range(len(names)) for value in (high[i], low[i])]
+    while trials:
+        fleet = make_fleet(trials)
+        breach, unit_steps = first_breach(fleet, iterations, timer)
+        stats['rounds'] += 1
+        stats['candidates'] += len(trials)
+        stats['unit_steps'] += unit_steps
+        for (i, value), step in zip(trials, breach):
+            if step == iterations:
+                best[i] = value if np.isnan(best[i]) else min(best[i], value)
+                high[i] = min(high[i], value)
+            else:
+                low[i] = max(low[i], value)
+        # next round: `candidates` evenly spaced values inside every open interval that passed its upper bound
+        trials = []
+        for i in range(len(names)):
+            if not np.isnan(best[i]) and high[i] - low[i] > tolerance:
+                values = low[i] + (high[i] - low[i]) * np.arange(1, candidates + 1) / (candidates + 1)
+                trials += [(i, float(value)) for value in values]
+    sizes = {name: (None if np.isnan(value) else float(value)) for name, value in zip(names, best)}
+    return sizes, stats
+
+def size_units(iterations, mps_configs, parameter='max_battery', low=0.0, high=None, tolerance=0.5, candidates=4, step_hours=None, timer=None):
+    # {MPS name: smallest `parameter` keeping it at or above the cutoff}, plus search statistics.
+    # high defaults to four times each unit's configured value.
+    if high is None:
+        high = [4 * config[parameter] for config in mps_configs]
+    names = [config['name'] for config in mps_configs]
+
+    def make_fleet(trials):
+        return CandidateFleet([dict(mps_configs[i], name=f"{names[i]}@{value:g}", **{parameter: value}) for i, value in trials], step_hours)
+
+    return _search(make_fleet, names, _lower_bound(parameter, low), high, tolerance, iterations, candidates, timer)
+
+def hub_aggregate(iterations, mps_configs, hub_config, step_hours=None, timer=None):
+    # (hub power in, hub power out) per iteration of the MPS fleet: what the hub is fed by the units
+    fleet = Fleet(mps_configs, hub_config, step_hours)
+    power_in = np.empty(iterations)
+    power_out = np.empty(iterations)
+    with phase(timer, 'unit steps'):
+        for iteration in range(iterations):
+            fleet.step()
+            power_in[iteration] = fleet.power_in[fleet.hub]
+            power_out[iteration] = fleet.power_out[fleet.hub]
+    return power_in, power_out
+
+def size_hub(iterations, mps_configs, hub_config, parameter='max_battery', low=0.0, high=None, tolerance=0.5, candidates=8, step_hours=None, timer=None):
+    # smallest hub `parameter` keeping the hub at or above the cutoff with the given (sized) units, plus search
+    # statistics. high defaults to four times the configured value.
+    if high is None:
+        high = 4 * hub_config[parameter]
+    aggregate = hub_aggregate(iterations, mps_configs, hub_config, step_hours, timer)
+
+    def make_fleet(trials):
+        return CandidateFleet([dict(hub_config, name=f"{hub_config['name']}@{value:g}", **{parameter: value}) for _, value in trials], step_hours, aggregate)
+
+    sizes, stats = _search(make_fleet, [hub_config['name']], _lower_bound(parameter, low), high, tolerance, iterations, candidates, timer)
+    stats['unit_steps'] += iterations * (len(mps_configs) + 1)
+    return sizes[hub_config['name']], stats
+
+def size_fleet(iterations, mps_configs, hub_config, parameters=('max_battery', 'max_solar'), hub_parameter='max_battery', tolerance=0.5, step_hours=None, timer=None):
+    # sizes every MPS parameter in turn (each search keeps the sizes found before it), then the hub;
+    # returns (sized mps configs, sized hub config, statistics per search)
+    mps_configs = [dict(config) for config in mps_configs]
+    stats = {}
+    for parameter in parameters:
+        sizes, stats[parameter] = size_units(iterations, mps_configs, parameter, tolerance=tolerance, step_hours=step_hours, timer=timer)
+        for config in mps_configs:
+            if sizes[config['name']] is None:
+                raise ValueError(f"{config['name']}: no {parameter} up to four times {config[parameter]} keeps it above the cutoff")
+            config[parameter] = sizes[config['name']]
+    hub_config = dict(hub_config)
+    size, stats['hub_' + hub_parameter] = size_hub(iterations, mps_configs, hub_config, hub_parameter, tolerance=tolerance, step_hours=step_hours, timer=timer)
+    if size is None:
+        raise ValueError(f"hub: no {hub_parameter} up to four times {hub_config[hub_parameter]} keeps it above the cutoff")
+    hub_config[hub_parameter] = size
+    return mps_configs, hub_config, stats
@@ -1,74 +1,199 @@
 # smart-bi-directional-simulation.py
 
+import threading
+import uuid
+import numpy as np
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
-from mps_class import MPS
-
-# Constants
-TYPE_STD = 0
-TYPE_HUB = 1
-
-# Simulation Function
-def run_simulation(iterations, mps_configs, hub_config):
-    # Initialize multiple MPS systems based on user configurations.
-    mps_systems = []
-    for config in mps_configs:
-        mps = MPS(
-            max_power=config['max_power'],
-            max_battery=config['max_battery'],
-            max_solar=config['max_solar'],
-            peak_sun_hours=config['peak_sun_hours'],
-            init_soc=config['init_soc'],
-            load_power=config['load_power'],
-            load_hours=config['load_hours'],
-            mps_type=TYPE_STD,
-            name=config['name']
-        )
-        mps_systems.append(mps)
-
-    # Initialize a central hub.
-    hub = MPS(
-        max_power=hub_config['max_power'],
-        max_battery=hub_config['max_battery'],
-        max_solar=hub_config['max_solar'],
-        peak_sun_hours=hub_config['peak_sun_hours'],
-        init_soc=hub_config['init_soc'],
-        load_power=hub_config['load_power'],
-        load_hours=hub_config['load_hours'],
-        mps_type=TYPE_HUB,
-        name=hub_config['name']
-    )
-
-    # Run simulation for the specified number of iterations, updating each MPS and the hub.
-    for iteration in range(iterations):
-        for mps in mps_systems:
-            mps.update(iteration)
-        hub.update(iteration)
-
-        # Link MPS outputs to hub inputs
-        hub.power_in = sum(mps.power_out for mps in mps_systems)
-        hub.power_out = sum(mps.power_in for mps in mps_systems)
-
-    # Collect results for each system
-    results = {'hub': hub.get_results()}
-    for mps in mps_systems:
-        results[mps.name] = mps.get_results()
+from cachetools import LRUCache
+from streamlit_autorefresh import st_autorefresh
+from simulation import config_hash
+from background import JobRegistry
+from job_service import ServiceRegistry, SERVICE_URL
+from result_store import ResultStore
+from incremental import IncrementalRunner
+from plotting import line_trace
+from results_table import ResultsTable, EXPORT_FORMATS
+from profiling import PhaseTimer, phase
+
+# Cache sizes (bytes) for simulation results and built figures, shared by all sessions
+RESULT_CACHE_BYTES = 512 * 2**20
+FIGURE_CACHE_BYTES = 128 * 2**20
+
+POLL_INTERVAL_MS = 1000  # dashboard refresh while a simulation runs in the background
+SHORT_RUN_WAIT = 0.5  # seconds to wait for a new run before showing progress (short runs appear at once)
+INCREMENTAL_MAX_UNITS = 8  # re-simulate at most this many changed units in the script thread, not as a job
+
+def results_nbytes(entry):
+    iterations, table, kpis = entry
+    return table.nbytes
+
+def figure_nbytes(fig):
+    # approximate: 8 bytes per x and y point
+    return sum(8 * (len(trace.x if trace.x is not None else ()) + len(trace.y if trace.y is not None else ())) for trace in fig.data) + 4096
+
+@st.cache_resource
+def get_caches():
+    # LRU caches keyed by config_hash, evicting the least recently used entries past their byte budget
+    return {
+        'results': LRUCache(maxsize=RESULT_CACHE_BYTES, getsizeof=results_nbytes),
+        'figures': LRUCache(maxsize=FIGURE_CACHE_BYTES, getsizeof=figure_nbytes),
+        'lock': threading.Lock(),
+    }
 
-    return results
+def cache_get(name, key):
+    caches = get_caches()
+    with caches['lock']:
+        return caches[name].get(key)
+
+def cache_put(name, key, value):
+    caches = get_caches()
+    with caches['lock']:
+        if caches[name].getsizeof(value) <= caches[name].maxsize:
+            caches[name][key] = value
+
+@st.cache_resource
+def get_job_registry():
+    # background simulations, shared by all sessions and kept across reruns
+    return JobRegistry()
+
+def get_jobs():
+    # the job service's queue (job_service.py) when MPS_JOB_SERVICE is set, else this process's background jobs
+    if SERVICE_URL:
+        client = st.session_state.setdefault('client', uuid.uuid4().hex)
+        return ServiceRegistry(SERVICE_URL, get_store(), client)
+    return get_job_registry()
+
+@st.cache_resource
+def get_store():
+    # results of past runs on disk (result_store.DEFAULT_STORE_URL), kept across sessions and restarts
+    return ResultStore()
+
+@st.cache_resource
+def get_runner():
+    # unit trajectories of past runs, so that editing a few units only re-simulates those (incremental.py)
+    return IncrementalRunner()
+
+def simulation_job(iterations, mps_configs, hub_config, sample=False, start=False):
+    # returns (key, ResultsTable or None, job or None): the cached or stored results of the configuration,
+    # or its background job; identical configurations are only simulated once. Only start=True (the user
+    # clicked "Run Simulation") simulates anything new, so a cancelled or failed run stays stopped on reruns.
+    key = config_hash(iterations, mps_configs, hub_config)
+    entry = cache_get('results', key)
+    if entry is not None:
+        return key, entry[1], None
+    stored = get_store().load(key)
+    if stored is not None:
+        get_runner().seed(iterations, mps_configs, stored)
+        entry = (iterations, ResultsTable(stored), None)
+        cache_put('results', key, entry)
+        return key, entry[1], None
+    jobs = get_jobs()
+    job = jobs.get(key)
+    runner = get_runner()
+    if start and job is None and len(runner.missing(iterations, mps_configs)) <= min(INCREMENTAL_MAX_UNITS, len(mps_configs) - 1):
+        # most units are unchanged since an earlier run: only the others and the hub are stepped
+        timer = st.session_state.setdefault('simulation_timer', PhaseTimer())
+        results = runner.run(iterations, mps_configs, hub_config, timer)
+        timer.count('incremental_units', runner.simulated)
+        entry = (iterations, ResultsTable(results), None)
+        cache_put('results', key, entry)
+        get_store().save(key, results, {'mps_configs': mps_configs, 'hub_config': hub_config})
+        return key, entry[1], None
+    if start and (job is None or job.cancelled or job.error is not None):
+        st.session_state.pop('simulation_stopped', None)
+        job = jobs.start(key, iterations, mps_configs, hub_config, sample=sample)
+    if job is None:
+        return key, None, None
+    if job.finished:
+        # move the finished run into the results cache and the store
+        with phase(job.timer, 'results table'):
+            entry = (iterations, ResultsTable(job.results()), job.kpis)
+        cache_put('results', key, entry)
+        with phase(job.timer, 'result store'):
+            get_store().save(key, job.results(), {'mps_configs': mps_configs, 'hub_config': hub_config})
+        get_runner().seed(iterations, mps_configs, job.results())
+        jobs.discard(key)
+        st.session_state['simulation_timer'] = job.timer
+        return key, entry[1], None
+    return key, None, job
+
+def cached_kpis(key):
+    # fleet KPIs accumulated while the cached run was simulated (None for runs loaded from the store)
+    entry = cache_get('results', key)
+    return entry[2] if entry is not None else None
+
+def job_status(key, job):
+    # progress and cancel control of a background run; returns the partial results to show, if any
+    if job is None:
+        return stopped_status(key)
+    if job.error is not None:
+        get_jobs().discard(job.key)
+        st.session_state['simulation_stopped'] = (job.key, 'error', f"Simulation failed: {job.error}")
+        return stopped_status(job.key)
+    if job.cancelled and not job.running:
+        get_jobs().discard(job.key)
+        st.session_state['simulation_stopped'] = (job.key, 'warning', f"Simulation cancelled after {job.done} of {job.iterations} iterations.")
+        stopped_status(job.key)
+    else:
+        st_autorefresh(interval=POLL_INTERVAL_MS, key='simulation-poll')
+        st.progress(job.progress, text=f"Running simulation: {job.done} of {job.iterations} iterations")
+        if st.button("Cancel Simulation"):
+            job.cancel()
+    partial = job.results()
+    return ResultsTable(partial) if partial is not None and job.done else None
+
+def stopped_status(key):
+    # why the run of this configuration is not going on (kept across reruns until "Run Simulation")
+    stopped = st.session_state.get('simulation_stopped')
+    if stopped is not None and stopped[0] == key:
+        getattr(st, stopped[1])(stopped[2])
+    else:
+        st.info("Click \"Run Simulation\" to simulate this configuration.")
+    return None
+
+def cached_figure(key, build, timer=None):
+    # key is None when the results are not cached (no reuse possible)
+    fig = cache_get('figures', key) if key is not None else None
+    if fig is None:
+        with phase(timer, 'figure building'):
+            fig = build()
+        if key is not None:
+            cache_put('figures', key, fig)
+    return fig
+
+def performance_panel(panel, simulation_timer, render_timer):
+    # timings of the last simulation run and of this rerun's rendering, exportable as JSON
+    with panel:
+        report = PhaseTimer()
+        report.merge(simulation_timer)
+        report.merge(render_timer)
+        rows = report.report()
+        if not rows:
+            st.write("No timings yet.")
+            return
+        st.dataframe(pd.DataFrame(rows).set_index('phase'), use_container_width=True)
+        step_loop = report.phases.get('step loop')
+        if step_loop and report.counters['unit_steps']:
+            st.caption(f"{report.counters['unit_steps']} unit steps, {1e6 * step_loop[1] / report.counters['unit_steps']:.2f} µs per unit step")
+        if report.profile:
+            st.caption(f"Sampling profile ({report.profile['samples']} samples), top functions:")
+            st.dataframe(pd.DataFrame(report.profile['self'][:10]), use_container_width=True)
+        st.download_button("Download Timings (JSON)", data=report.to_json(), file_name="performance.json", mime='application/json')
 
 # Matplotlib Plotting Function
 def plot_results(results, iterations):
 
-    fig, axs = plt.subplots(len(results), 1, figsize=(10, 5 * len(results)))
+    fig, axs = plt.subplots(len(results.systems), 1, figsize=(10, 5 * len(results.systems)))
 
-    if len(results) == 1:
+    if len(results.systems) == 1:
         axs = [axs]  # Make it iterable
 
     # Create subplots for each MPS and the hub.
-    for ax, (name, data) in zip(axs, results.items()):
-        df = pd.DataFrame(data)
+    for ax, name in zip(axs, results.systems):
+        df = results.system_frame(name)
         df['iteration'] = range(iterations)
 
         #Plots various metrics like SOC, remaining battery, charge/discharge rates, solar input, local load, power in/out.
@@ -93,8 +218,8 @@ def plot_results(results, iterations):
 
 # Plotly Plotting Function
 def plot_results_plotly(results, iterations):
-    for name, data in results.items():
-        df = pd.DataFrame(data)
+    for name in results.systems:
+        df = results.system_frame(name)
         df['iteration'] = range(iterations)
 
         fig = go.Figure()
@@ -110,85 +235,69 @@ def plot_results_plotly(results, iterations):
         fig.update_layout(title=f'Results for {name}', xaxis_title='Iteration', yaxis_title='Values', legend_title='Metrics')
         st.plotly_chart(fig)
 
-def plot_results_plotly2(name, data, iterations):
-    df = pd.DataFrame(data)
-    df['iteration'] = range(iterations)
+RESULT_TRACES = {
+    'soc': 'SOC (%)',
+    'remaining_battery': 'Remaining Battery (kWh)',
+    'bat_charge': 'Battery Charge (kW)',
+    'bat_discharge': 'Battery Discharge (kW)',
+    'solar_input': 'Solar Input (kW)',
+    'local_load': 'Local Load (kW)',
+    'power_in': 'Power In (kW)',
+    'power_out': 'Power Out (kW)',
+}
+
+def build_results_figure(name, results, iterations, x_range=None):
+    # traces are downsampled to the plotting point budget; x_range re-reads full resolution for a zoom window
+    x = np.arange(iterations)
 
     fig = go.Figure()
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['soc'], mode='lines', name='SOC (%)'))
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['remaining_battery'], mode='lines', name='Remaining Battery (kWh)'))
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['bat_charge'], mode='lines', name='Battery Charge (kW)'))
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['bat_discharge'], mode='lines', name='Battery Discharge (kW)'))
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['solar_input'], mode='lines', name='Solar Input (kW)'))
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['local_load'], mode='lines', name='Local Load (kW)'))
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['power_in'], mode='lines', name='Power In (kW)'))
-    fig.add_trace(go.Scatter(x=df['iteration'], y=df['power_out'], mode='lines', name='Power Out (kW)'))
+    for metric, label in RESULT_TRACES.items():
+        fig.add_trace(line_trace(x, results.series(name, metric), label, x_range))
 
     fig.update_layout(title=f'Results for {name}', xaxis_title='Iteration', yaxis_title='Values', legend_title='Metrics')
+    return fig
+
+def plot_results_plotly2(name, results, iterations, cache_key=None, x_range=None, timer=None):
+    fig = cached_figure(cache_key and (cache_key, name, x_range), lambda: build_results_figure(name, results, iterations, x_range), timer)
     st.plotly_chart(fig, use_container_width=True)
 
-def plot_results_separated2(results, iterations):
+def kpi_panel(kpis):
+    # fleet totals as metrics and one row of KPIs per system, all accumulated during the run
+    summary = kpis.summary()
+    fleet = summary.pop('fleet')
+    columns = st.columns(4)
+    columns[0].metric("Min SOC (%)", f"{fleet['min_soc']:.1f}")
+    columns[1].metric("Steps Below Cutoff", fleet['steps_below_cutoff'], help=f"{fleet['units_below_cutoff']} systems went below the cutoff")
+    columns[2].metric("Unserved Load (kWh)", f"{fleet['unserved_energy']:.1f}")
+    columns[3].metric("Hub Exchange (kWh)", f"{fleet['energy_in'] + fleet['energy_out']:.1f}", help="energy taken from plus given to the hub")
+    st.dataframe(pd.DataFrame.from_dict(summary, orient='index'), use_container_width=True)
+
+def plot_results_separated2(results, iterations, kpis=None):
     """
     For each MPS, plot its metrics separately using the provided plot_results_plotly function.
-    Also, create a global plot aggregating key metrics across all systems.
+    Also, create a global plot aggregating key metrics across all systems, and show the fleet KPIs
+    accumulated during the run (kpis.FleetKPIs) when they are given.
     """
     # Create an expander for Per-MPS Plots
     with st.expander("View Per-MPS Detailed Plots"):
-        for system_name, data in results.items():
+        for system_name in results.systems:
             st.subheader(f"Results for {system_name}")
-            plot_results_plotly2(system_name, data, iterations)
+            plot_results_plotly2(system_name, results, iterations)
 
     # Create a separate section for Global Metrics
     st.subheader("Global Metrics Across All Systems")
     fig_global = go.Figure()
+    x = np.arange(iterations)
 
-    # Aggregate Total SOC across all systems
-    total_soc = None
-    for system_name, data in results.items():
-        df = pd.DataFrame(data)
-        if total_soc is None:
-            total_soc = df['soc']
-        else:
-            total_soc += df['soc']
-
-    if total_soc is not None:
-        fig_global.add_trace(go.Scatter(
-            x=list(range(iterations)),
-            y=total_soc,
-            mode='lines',
-            name='Total SOC'
-        ))
-
-    # Aggregate Total Power In and Power Out
-    total_power_in = 0
-    total_power_out = 0
-    for system_name, data in results.items():
-        df = pd.DataFrame(data)
-        total_power_in += df['power_in']
-        total_power_out += df['power_out']
-
-    fig_global.add_trace(go.Scatter(
-        x=list(range(iterations)),
-        y=total_power_in,
-        mode='lines',
-        name='Total Power In'
-    ))
-
-    fig_global.add_trace(go.Scatter(
-        x=list(range(iterations)),
-        y=total_power_out,
-        mode='lines',
-        name='Total Power Out'
-    ))
+    # Aggregate Total SOC, Power In and Power Out across all systems (straight from the long table)
+    total_soc = results.total('soc')
+    fig_global.add_trace(line_trace(x, total_soc, 'Total SOC'))
+    fig_global.add_trace(line_trace(x, results.total('power_in'), 'Total Power In'))
+    fig_global.add_trace(line_trace(x, results.total('power_out'), 'Total Power Out'))
 
     # Calculate and plot Average SOC
-    average_soc = total_soc / len(results) if len(results) > 0 else 0
-    fig_global.add_trace(go.Scatter(
-        x=list(range(iterations)),
-        y=[average_soc] * iterations,
-        mode='lines',
-        name='Average SOC'
-    ))
+    average_soc = total_soc / len(results.systems)
+    fig_global.add_trace(line_trace(x, average_soc, 'Average SOC'))
 
     fig_global.update_layout(
         title='Global Metrics Across All Systems',
@@ -200,12 +309,39 @@ def plot_results_separated2(results, iterations):
 
     st.plotly_chart(fig_global, use_container_width=True)
 
-def plot_results_separated(results, iterations):
+    if kpis is not None:
+        st.subheader("Fleet KPIs")
+        kpi_panel(kpis)
+
+def build_group_figure(system_name, group_name, metrics, results, iterations, x_range=None):
+    fig = go.Figure()
+    x = np.arange(iterations)
+
+    for metric in metrics:
+        fig.add_trace(line_trace(x, results.series(system_name, metric), metric, x_range))
+
+    fig.update_layout(
+        title=f'{group_name} for {system_name}',
+        xaxis_title='Iteration',
+        yaxis_title='Values',
+        legend_title='Metrics',
+        hovermode='closest'
+    )
+    return fig
+
+def plot_results_separated(results, iterations, cache_key=None, timer=None):
+    # Long runs are drawn downsampled; pick a window to see it at full resolution
+    x_range = None
+    if iterations > 1:
+        window = st.slider("Zoom (iterations)", min_value=0, max_value=iterations - 1, value=(0, iterations - 1))
+        if window != (0, iterations - 1):
+            x_range = window
+
     # Create an expander for Per-MPS Plots
     with st.expander("View Per-MPS Detailed Plots"):
-        for system_name, data in results.items():
+        for system_name in results.systems:
             st.subheader(f"Results for {system_name}")
-            plot_results_plotly2(system_name, data, iterations)
+            plot_results_plotly2(system_name, results, iterations, cache_key, x_range, timer)
 
     # Define metric groups
     metric_groups = {
@@ -219,7 +355,7 @@ def plot_results_separated(results, iterations):
     #selected_systems = st.multiselect("Select Systems for Global Metrics", options=system_names, default=system_names)
 
     # Iterate through each MPS and create separate plots
-    for system_name, data in results.items():
+    for system_name in results.systems:
         st.subheader(f"Results for {system_name}")
 
         # Create tabs for different metric groups within each MPS
@@ -227,26 +363,8 @@ def plot_results_separated(results, iterations):
 
         for tab, (group_name, metrics) in zip(tabs, metric_groups.items()):
             with tab:
-                fig = go.Figure()
-                df = pd.DataFrame(data)
-                df['iteration'] = range(iterations)
-
-                for metric in metrics:
-                    fig.add_trace(go.Scatter(
-                        x=df['iteration'],
-                        y=df[metric],
-                        mode='lines',
-                        name=metric
-                    ))
-
-                fig.update_layout(
-                    title=f'{group_name} for {system_name}',
-                    xaxis_title='Iteration',
-                    yaxis_title='Values',
-                    legend_title='Metrics',
-                    hovermode='closest'
-                )
-
+                fig = cached_figure(cache_key and (cache_key, system_name, group_name, x_range),
+                                    lambda: build_group_figure(system_name, group_name, metrics, results, iterations, x_range), timer)
                 st.plotly_chart(fig, use_container_width=True)
 _ ="""
     # Global Metrics Plot
@@ -258,9 +376,9 @@ _ ="""
     for system_name, data in results.items():
         if system_name not in selected_systems:
             continue
-        df = pd.DataFrame(data)
+        df = data.to_dataframe()
         if total_soc is None:
-            total_soc = df['soc']
+            total_soc = df['soc'].copy()
         else:
             total_soc += df['soc']
 
@@ -278,7 +396,7 @@ _ ="""
     for system_name, data in results.items():
         if system_name not in selected_systems:
             continue
-        df = pd.DataFrame(data)
+        df = data.to_dataframe()
         total_power_in += df['power_in']
         total_power_out += df['power_out']
 
@@ -325,7 +443,7 @@ def main():
     st.sidebar.header("Simulation Parameters")
 
     # Simulation parameters
-    iterations = st.sidebar.number_input("Number of Iterations", min_value=1, max_value=1000, value=48, step=1)
+    iterations = st.sidebar.number_input("Number of Iterations", min_value=1, max_value=48 * 365, value=48, step=1)
     num_sys = st.sidebar.number_input("Number of MPS Systems", min_value=1, max_value=10, value=4, step=1)
 
     # MPS configurations
@@ -375,27 +493,62 @@ def main():
         'load_hours': hub_load_hours
     }
 
-    if st.sidebar.button("Run Simulation"):
-        with st.spinner("Running simulation..."):
-            results = run_simulation(iterations, mps_configs, hub_config)
-        st.success("Simulation completed!")
-
-        # Display results
+    run_clicked = st.sidebar.button("Run Simulation")
+    perf_panel = st.sidebar.expander("Performance")
+    sample = perf_panel.checkbox("Sampling profiler", value=False, help="Sample the call stack while the simulation runs")
+    render_timer = PhaseTimer()
+
+    if run_clicked:
+        st.session_state['simulation'] = (iterations, mps_configs, hub_config)
+        st.session_state['simulation_timer'] = PhaseTimer()
+        _, results, job = simulation_job(iterations, mps_configs, hub_config, sample, start=True)
+        if job is not None:
+            job.join(SHORT_RUN_WAIT)
+        elif results is not None and not st.session_state['simulation_timer'].counters['incremental_units']:
+            st.session_state['simulation_timer'].count('cache_hits')
+
+    # Keep showing the last run across reruns. It runs in the background (surviving reruns) until it
+    # finishes, and is loaded from the result store if it was evicted from the cache.
+    if 'simulation' in st.session_state:
+        iterations, mps_configs, hub_config = st.session_state['simulation']
+        results_key, results, job = simulation_job(iterations, mps_configs, hub_config)
+
+        # Display results (the partial results while the simulation is still running)
         st.header("Simulation Results")
         #plot_results(results, iterations)
         #plot_results_plotly(results, iterations)
-        plot_results_separated(results, iterations)
-
-        # Optionally, provide download option for CSV
-        for name, data in results.items():
-            df = pd.DataFrame(data)
-            csv = df.to_csv(index=False).encode('utf-8')
+        if results is None:
+            partial = job_status(results_key, job)
+            if partial is not None:
+                with phase(render_timer, 'plotting'):
+                    plot_results_separated(partial, partial.iterations, None, render_timer)
+            performance_panel(perf_panel, st.session_state.get('simulation_timer', PhaseTimer()), render_timer)
+            return
+
+        if run_clicked:
+            st.success("Simulation completed!")
+        with phase(render_timer, 'plotting'):
+            plot_results_separated(results, iterations, results_key, render_timer)
+        kpis = cached_kpis(results_key)
+        if kpis is not None:
+            with st.expander("Fleet KPIs"):
+                kpi_panel(kpis)
+
+        # Optionally, export every system in one bundle, built only when asked for
+        export_format = st.selectbox("Export format", list(EXPORT_FORMATS))
+        export_key = (results_key, export_format)
+        if st.button("Prepare Results Download"):
+            st.session_state['export'] = (export_key, results.export(export_format))
+        if st.session_state.get('export', (None,))[0] == export_key:
+            file_name, mime = EXPORT_FORMATS[export_format]
             st.download_button(
-                label=f"Download {name} Results as CSV",
-                data=csv,
-                file_name=f"{name}_results.csv",
-                mime='text/csv',
+                label=f"Download Results ({export_format})",
+                data=st.session_state['export'][1],
+                file_name=file_name,
+                mime=mime,
             )
 
+    performance_panel(perf_panel, st.session_state.get('simulation_timer', PhaseTimer()), render_timer)
+
 if __name__ == "__main__":
     main()
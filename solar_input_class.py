@@ -1,25 +1,35 @@
 # solar_input_class.py
 import numpy as np
-from scipy.stats import norm
-import matplotlib.pyplot as plt
+from profile_cache import solar_curve, profile_hours, SOLAR_MEAN, SOLAR_STD_DEV
+from measured_series import SeriesReader
+
+SOLAR_GAIN = 4  # MPS.update multiplies the solar output by this (see the todo there)
 
 class SolarInput:
-    def __init__(self, max_kw, peak_sun_hours):
+    def __init__(self, max_kw, peak_sun_hours, step_hours=None, series=None):
         self.max_kw = max_kw
         self.peak_sun_hours = peak_sun_hours
-        self.X = np.linspace(0, 24, 24) # 0 to 24 hours
-        self.mean = 12  # Noon
-        self.std_dev = 3  # Standard deviation
+        self.step_hours = step_hours  # None: one sample per iteration over a 24 point day
+        self.series = series  # measured_series.MeasuredSeries used instead of the synthetic day
+        self.reader = SeriesReader(series, step_hours) if series is not None else None
+        self.X = np.linspace(0, 24, 24) if step_hours is None else profile_hours(step_hours) # 0 to 24 hours
+        self.mean = SOLAR_MEAN  # Noon
+        self.std_dev = SOLAR_STD_DEV  # Standard deviation
         self.Y = self.calculate_distribution()
         #self.plot_distribution()
 
+    @classmethod
+    def from_series(cls, series, step_hours=None):
+        # measured panel output (kW) resampled to the simulation step
+        return cls(0, 0, step_hours, series)
+
     def calculate_distribution(self):
-        Y = self.max_kw * self.peak_sun_hours * norm.pdf(self.X, self.mean, self.std_dev)
-        area = np.trapz(Y, self.X)
-        #print(f"kwh / day: {area:.2f}")
-        return Y
+        # shared with every other SolarInput of the same panel (see profile_cache)
+        return solar_curve(self.max_kw, self.peak_sun_hours, self.step_hours)
 
     def plot_distribution(self):
+        import matplotlib.pyplot as plt  # only needed here, keeps matplotlib out of headless runs
+
         plt.plot(self.X, self.Y, label='Standard Normal Distribution')
         plt.xlabel('X')
         plt.ylabel('Probability Density')
@@ -30,7 +40,10 @@ class SolarInput:
 
     # Get the solar output for a given time
     def get_output(self, x):
-        # x is the time in hours since the start of the simulation
-        # need to get it in the form of 0-24 hours, to represent the time of day
-        x = x % 24
+        # x is the iteration since the start of the simulation (an int or an array of them)
+        # need to get it in the form of a step of the day, to represent the time of day
+        if self.reader is not None:
+            # MPS.update scales the output back up, so the measured values reach the battery unchanged
+            return self.reader[x] / SOLAR_GAIN
+        x = x % len(self.Y)
         return self.Y[x]
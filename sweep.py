@@ -0,0 +1,103 @@
+# sweep.py
+
+import itertools
+import os
+from multiprocessing import Pool, shared_memory
+import numpy as np
+from mps_class import CUTOFF_THRESHOLD, step_duration
+from simulation import run_simulation
+
+# Parameter sweeps over MPS and hub configurations.
+# Scenarios are spread over a process pool; every worker attaches once to a shared-memory summary table
+# and writes its scenario rows in place, so only the scenario parameters travel between processes.
+
+MPS_PARAMETERS = ['max_power', 'max_battery', 'max_solar', 'peak_sun_hours', 'init_soc', 'load_power', 'load_hours']
+HUB_PARAMETERS = ['hub_' + parameter for parameter in MPS_PARAMETERS]  # e.g. hub_max_battery for the hub size
+SUMMARY_METRICS = ['min_soc', 'mean_final_soc', 'hub_min_soc', 'hub_final_soc', 'energy_from_hub', 'energy_to_hub', 'steps_below_cutoff']
+RECORDED_VARIABLES = ['soc', 'power_in', 'power_out']
+
+def sweep_grid(**axes):
+    # cartesian product of the given parameter values, one dict per scenario
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+def scenario_configs(scenario, base_mps_config, base_hub_config, num_mps=1):
+    for key in scenario:
+        if key not in MPS_PARAMETERS and key not in HUB_PARAMETERS:
+            raise ValueError(f"unknown sweep parameter: {key}")
+    mps_config = dict(base_mps_config, **{key: value for key, value in scenario.items() if key in MPS_PARAMETERS})
+    hub_config = dict(base_hub_config, **{key[len('hub_'):]: value for key, value in scenario.items() if key in HUB_PARAMETERS})
+    mps_configs = [dict(mps_config, name=f"mps{i+1}") for i in range(num_mps)]
+    return mps_configs, hub_config
+
+def summarize(results, step_hours=None):
+    # one row of SUMMARY_METRICS for the results of run_simulation
+    hours = step_duration(step_hours)
+    hub = results['hub']
+    units = [data for name, data in results.items() if name != 'hub']
+    soc = np.array([data['soc'] for data in units])
+    return [
+        soc.min(),
+        soc[:, -1].mean(),
+        hub['soc'].min(),
+        hub['soc'][-1],
+        sum(data['power_in'].sum() for data in units) * hours,
+        sum(data['power_out'].sum() for data in units) * hours,
+        (soc < CUTOFF_THRESHOLD).any(axis=0).sum(),
+    ]
+
+# worker state, set once per process by _init_worker
+_worker = {}
+
+def _init_worker(shm_name, shape, iterations, base_mps_config, base_hub_config, num_mps, step_hours):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(
+        shm=shm,
+        table=np.ndarray(shape, dtype=np.float64, buffer=shm.buf),
+        iterations=iterations,
+        base_mps_config=base_mps_config,
+        base_hub_config=base_hub_config,
+        num_mps=num_mps,
+        step_hours=step_hours,
+    )
+
+def _run_scenario(task):
+    index, scenario = task
+    mps_configs, hub_config = scenario_configs(scenario, _worker['base_mps_config'], _worker['base_hub_config'], _worker['num_mps'])
+    results = run_simulation(_worker['iterations'], mps_configs, hub_config, variables=RECORDED_VARIABLES, step_hours=_worker['step_hours'], fast_forward=True)
+    _worker['table'][index] = summarize(results, _worker['step_hours'])
+    return index
+
+def run_sweep(iterations, scenarios, base_mps_config, base_hub_config, num_mps=1, processes=None, chunksize=None, step_hours=None):
+    # scenarios: list of parameter dicts (see sweep_grid); returns one summary row per scenario
+    import pandas as pd
+
+    scenarios = list(scenarios)
+    shape = (len(scenarios), len(SUMMARY_METRICS))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 8))
+    try:
+        initargs = (shm.name, shape, iterations, base_mps_config, base_hub_config, num_mps, step_hours)
+        tasks = list(enumerate(scenarios))
+        processes = processes or os.cpu_count() or 1
+        if processes == 1:
+            _init_worker(*initargs)
+            for task in tasks:
+                _run_scenario(task)
+            _worker.pop('shm').close()
+            _worker.clear()
+        else:
+            # a few chunks per worker balances load without paying per-scenario task overhead
+            chunksize = chunksize or max(1, len(tasks) // (processes * 4))
+            with Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+                for _ in pool.imap_unordered(_run_scenario, tasks, chunksize=chunksize):
+                    pass
+        table = np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    summary = pd.DataFrame(scenarios)
+    for column, metric in enumerate(SUMMARY_METRICS):
+        summary[metric] = table[:, column]
+    summary['steps_below_cutoff'] = summary['steps_below_cutoff'].astype(np.int64)
+    return summary
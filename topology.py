@@ -0,0 +1,167 @@
+# topology.py
+
+import json
+import numpy as np
+from mps_class import TYPE_HUB
+from fleet_class import Fleet
+from results_recorder_class import RESULT_VARIABLES
+from profiling import phase
+
+# Networks of several hubs and MPS joined by capacity-limited links.
+# Every MPS splits what it offers to the hubs (power_out) and what it draws from them (power_in) evenly over
+# its links. A link carries at most its capacity in each direction and the rest is reported as unserved
+# on that link. power_in / power_out stay what the MPS asks for (its latching is unchanged), but only the
+# served part reaches its battery (Fleet.served_in / served_out, bat_charge / bat_discharge), so its SOC
+# changes by the served energy. Units whose links are not congested behave exactly as in the star topology
+# of run_simulation.
+# A hub receives the export flows of its links as power_in and supplies their import flows as power_out
+# (read on the next step, like the single hub). Flows are sparse incidence-matrix products, so large
+# networks step at the same vectorized speed as a Fleet.
+#
+# Config (JSON or TOML):
+#   hubs  = [{name, max_power, max_battery, ...}]           same fields as hub_config
+#   mps   = [{name, max_power, max_battery, ...}]           same fields as mps_configs
+#   links = [{mps = "mps1", hub = "hub1", capacity = 10.0}]  capacity in kW, omitted = unlimited; every MPS needs one
+
+LINK_VARIABLES = ['export_flow', 'export_unserved', 'import_flow', 'import_unserved']
+
+def read_config(path):
+    # JSON or TOML file (by extension) as a dict
+    if str(path).endswith('.toml'):
+        try:
+            import tomllib
+            with open(path, 'rb') as f:
+                return tomllib.load(f)
+        except ImportError:
+            import toml
+            return toml.load(path)
+    with open(path) as f:
+        return json.load(f)
+
+def load_topology(path):
+    return check_topology(read_config(path))
+
+def check_topology(config):
+    hubs = [hub['name'] for hub in config.get('hubs', [])]
+    units = [mps['name'] for mps in config.get('mps', [])]
+    if not hubs:
+        raise ValueError("topology needs at least one hub")
+    names = hubs + units
+    if len(set(names)) != len(names):
+        raise ValueError("hub and MPS names must be unique")
+    hubs, units = set(hubs), set(units)
+    for link in config.get('links', []):
+        if link['mps'] not in units:
+            raise ValueError(f"link to unknown MPS: {link['mps']}")
+        if link['hub'] not in hubs:
+            raise ValueError(f"link to unknown hub: {link['hub']}")
+        if link.get('capacity', np.inf) < 0:
+            raise ValueError(f"negative link capacity: {link['mps']} -> {link['hub']}")
+    # an MPS without links has no hub to exchange power with (its transfers would reach its battery unserved)
+    linked = {link['mps'] for link in config.get('links', [])}
+    unlinked = [mps['name'] for mps in config.get('mps', []) if mps['name'] not in linked]
+    if unlinked:
+        raise ValueError(f"MPS without links: {', '.join(unlinked)}")
+    return config
+
+class Network(Fleet):
+    def __init__(self, config, step_hours=None, timer=None):
+        from scipy import sparse
+
+        check_topology(config)
+        super().__init__(config['mps'], config['hubs'], step_hours, timer=timer)
+        links = config.get('links', [])
+        self.links = [(link['mps'], link['hub']) for link in links]
+        self.capacity = np.array([link.get('capacity', np.inf) for link in links], dtype=np.float64)
+
+        index = {name: i for i, name in enumerate(self.names)}
+        link_units = np.array([index[mps] for mps, _ in self.links], dtype=np.int64)
+        link_hubs = np.array([index[hub] - self.hubs[0] for _, hub in self.links], dtype=np.int64)
+        self.units = np.flatnonzero(self.mps_type != TYPE_HUB)
+        n_links, n_units, n_hubs = len(links), len(self.units), len(self.hubs)
+
+        # link x unit: share of the unit's power carried by each of its links
+        degree = np.bincount(link_units, minlength=n_units)
+        self.split = sparse.csr_matrix((1.0 / degree[link_units], (np.arange(n_links), link_units)), shape=(n_links, n_units))
+        # unit x link: the links of every unit
+        self.unit_links = sparse.csr_matrix((np.ones(n_links), (link_units, np.arange(n_links))), shape=(n_units, n_links))
+        # hub x link incidence
+        self.incidence = sparse.csr_matrix((np.ones(n_links), (link_hubs, np.arange(n_links))), shape=(n_hubs, n_links))
+
+        self.export_flow = np.zeros(n_links)
+        self.export_unserved = np.zeros(n_links)
+        self.import_flow = np.zeros(n_links)
+        self.import_unserved = np.zeros(n_links)
+        self.link_results = None  # (variable, link, iteration) buffer while recording
+
+    def _transfer(self, power):
+        # per-link flow (capped at the link capacity in either direction) and unserved part
+        offered = self.split @ power[self.units]
+        flow = np.clip(offered, -self.capacity, self.capacity)
+        return flow, offered - flow
+
+    def _serve_transfers(self):
+        # every unit exchanges what its links carry: its transfer minus the unserved part on its links
+        self.export_flow, self.export_unserved = self._transfer(self.power_out)
+        self.import_flow, self.import_unserved = self._transfer(self.power_in)
+        self.served_out = self.power_out.copy()
+        self.served_in = self.power_in.copy()
+        self.served_out[self.units] -= self.unit_links @ self.export_unserved
+        self.served_in[self.units] -= self.unit_links @ self.import_unserved
+
+    def _link(self):
+        self.power_in[self.hubs] = self.incidence @ self.export_flow
+        self.power_out[self.hubs] = self.incidence @ self.import_flow
+        if self.link_results is not None:
+            column = self.iteration - self.record_start
+            for row, var in enumerate(LINK_VARIABLES):
+                self.link_results[row, :, column] = getattr(self, var)
+
+    def run(self, iterations, record=True, variables=RESULT_VARIABLES, dtype=np.float64, fast_forward=False):
+        self.link_results = np.zeros((len(LINK_VARIABLES), len(self.links), iterations), dtype=dtype) if record else None
+        super().run(iterations, record, variables, dtype, fast_forward)
+
+    def _fast_forward(self, cycle, skip):
+        if self.link_results is not None:
+            start = self.iteration - self.record_start
+            source = self.link_results[:, :, start - cycle:start]
+            for offset in range(0, skip, cycle):
+                self.link_results[:, :, start + offset:start + offset + cycle] = source
+        super()._fast_forward(cycle, skip)
+
+    def get_results(self):
+        # hubs keyed by their names however many there are (the 'hub' key is run_simulation's star topology)
+        return super().get_results(hub_names=True)
+
+    def get_link_results(self):
+        # {variable: (link, iteration) array}, links in config order (see self.links)
+        length = self.iteration - self.record_start
+        return {var: self.link_results[row, :, :length] for row, var in enumerate(LINK_VARIABLES)}
+
+    def unserved_report(self):
+        # per-link totals of the recorded run: energy moved and left unserved (kWh) and congested steps
+        import pandas as pd
+
+        data = self.get_link_results()
+        return pd.DataFrame({
+            'mps': [mps for mps, _ in self.links],
+            'hub': [hub for _, hub in self.links],
+            'capacity': self.capacity,
+            'export_energy': np.abs(data['export_flow']).sum(axis=1) * self.step_duration,
+            'export_unserved_energy': np.abs(data['export_unserved']).sum(axis=1) * self.step_duration,
+            'import_energy': np.abs(data['import_flow']).sum(axis=1) * self.step_duration,
+            'import_unserved_energy': np.abs(data['import_unserved']).sum(axis=1) * self.step_duration,
+            'congested_steps': ((data['export_unserved'] != 0) | (data['import_unserved'] != 0)).sum(axis=1),
+        })
+
+# Network counterpart of run_simulation(engine="fleet"): returns (results keyed by system name, hubs first; Network)
+def run_network(iterations, config, variables=RESULT_VARIABLES, dtype=np.float64, step_hours=None, timer=None, fast_forward=False, kpis=None):
+    if isinstance(config, str):
+        config = load_topology(config)
+    with phase(timer, 'construction'):
+        network = Network(config, step_hours, timer=timer)
+        if kpis is not None:
+            network.track_kpis(kpis)
+    with phase(timer, 'step loop'):
+        network.run(iterations, variables=variables, dtype=dtype, fast_forward=fast_forward)
+    return network.get_results(), network